@@ -0,0 +1,237 @@
+import sys
+import os
+import glob
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+
+# Differential harness for the engine variants in this directory (iengine.py, iengine(old).py, redo*.py, test.py, ...).
+# Every engine is run as its own process on the same KB files, through a small driver that imports the engine and
+# times only its main() (so interpreter start-up and imports are not counted), and the last line it prints is taken
+# as its answer. The first engine is the reference: answers that differ from it are mismatches, and times more than
+# --threshold times its time, by more than the noise, are slowdowns. With --baseline, times are also checked against
+# an earlier --save of the same engines, so an optimised rewrite can be checked against itself over time
+
+# Default engines and corpus when none are given
+ENGINES = ['iengine.py', 'iengine(old).py', 'redo.py', 'redo_3.py', 'redo_4.py', 'test.py']
+CORPUS = 'test_*.txt'
+
+# Slowdowns smaller than this many seconds, or than the spread between repeats of either run, are noise, never flagged
+MIN_SLOWDOWN = 0.005
+
+# Run in a fresh interpreter: import the engine (argv[1]) without running it, then time its main() on the rest of
+# argv with its output captured, and report the output and the time as one JSON line
+DRIVER = """
+import contextlib, importlib.util, io, json, sys, time
+spec = importlib.util.spec_from_file_location('engine', sys.argv[1])
+engine = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(engine)
+sys.argv = sys.argv[1:]
+output = io.StringIO()
+started = time.perf_counter()
+try:
+    with contextlib.redirect_stdout(output):
+        engine.main()
+    error = None
+except SystemExit:
+    error = None
+except Exception as exception:
+    error = f'{type(exception).__name__}: {exception}'
+seconds = time.perf_counter() - started
+print(json.dumps({'output': output.getvalue(), 'error': error, 'seconds': seconds}))
+"""
+
+# One random Horn KB over size symbols: a few facts and about 1.5 rules per symbol, asking a random symbol
+def horn_kb(rng, size):
+    symbols = [f"p{i}" for i in range(size)]
+    clauses = rng.sample(symbols, max(1, size // 4))
+    for _ in range(size + size // 2):
+        premises = rng.sample(symbols, rng.randint(1, min(3, size)))
+        clauses.append(f"{' & '.join(premises)} => {rng.choice(symbols)}")
+    return clauses, rng.choice(symbols)
+
+# One random general KB over size symbols, with the connectives the engines parse but no parentheses
+def general_kb(rng, size):
+    symbols = [f"p{i}" for i in range(size)]
+    clauses = []
+    for _ in range(size):
+        literals = [rng.choice(['', '~']) + symbol for symbol in rng.sample(symbols, rng.randint(1, min(3, size)))]
+        clause = literals[0]
+        for literal in literals[1:]:
+            clause += f" {rng.choice(['&', '||', '=>', '<=>'])} {literal}"
+        clauses.append(clause)
+    return clauses, rng.choice(symbols)
+
+GENERATORS = {'horn': horn_kb, 'general': general_kb}
+
+# Write the generated KBs to directory as TELL/ASK files. Names only depend on kind, size, index and seed, so a
+# baseline saved with the same settings lines up with a new run
+def generate_kbs(directory, kinds, sizes, count, seed):
+    kbs = []
+    for kind in kinds:
+        for size in sizes:
+            rng = random.Random(f"{seed}-{kind}-{size}")
+            for i in range(count):
+                clauses, query = GENERATORS[kind](rng, size)
+                path = os.path.join(directory, f"{kind}-{size}-{i}-s{seed}.txt")
+                with open(path, 'w') as file:
+                    file.write("TELL\n" + "; ".join(clauses) + ";\nASK\n" + query + "\n")
+                kbs.append((path, size, len(clauses)))
+    return kbs
+
+# Corpus KBs are sized by their number of distinct symbols
+def corpus_kbs(pattern):
+    kbs = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as file:
+            content = file.read()
+        if 'TELL' not in content or 'ASK' not in content:
+            continue
+        tell = content.split('ASK')[0].split('TELL')[1]
+        clauses = [clause for clause in tell.split(';') if clause.strip()]
+        symbols = set()
+        for clause in clauses:
+            for op in ['<=>', '=>', '||', '&', '~', '(', ')']:
+                clause = clause.replace(op, ' ')
+            symbols.update(clause.split())
+        kbs.append((path, len(symbols), len(clauses)))
+    return kbs
+
+# Run one engine once. Returns (answer, seconds in main()): the last line it printed, or ERROR/TIMEOUT when there is none
+def run_engine(engine, args, timeout):
+    try:
+        completed = subprocess.run([sys.executable, '-c', DRIVER, engine] + args, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return "TIMEOUT", timeout
+    try:
+        report = json.loads(completed.stdout.splitlines()[-1])
+    except (IndexError, ValueError):
+        errors = [line.strip() for line in completed.stderr.splitlines() if line.strip()]
+        return f"ERROR: {errors[-1] if errors else 'no output'}", 0.0
+    lines = [line.strip() for line in report['output'].splitlines() if line.strip()]
+    if report['error'] is not None:
+        return f"ERROR: {report['error']}", report['seconds']
+    return (lines[-1] if lines else "ERROR: no output"), report['seconds']
+
+# Run every engine on every KB with every method. The time of a run is the best of repeat, and its spread (worst
+# less best) is kept as a measure of the noise on it
+def measure(engines, kbs, methods, repeat, timeout):
+    records = []
+    for path, size, clauses in kbs:
+        for method in methods:
+            for engine in engines:
+                runs = [run_engine(engine, [path, method], timeout) for _ in range(repeat)]
+                answer = runs[0][0]
+                seconds = [seconds for _, seconds in runs]
+                records.append({'engine': engine, 'kb': os.path.basename(path), 'method': method,
+                                'size': size, 'clauses': clauses, 'answer': answer,
+                                'seconds': round(min(seconds), 6), 'spread': round(max(seconds) - min(seconds), 6)})
+    return records
+
+def answer_key(answer, compare):
+    return answer.split(':')[0].strip() if compare == 'answer' else answer
+
+# Mismatches against the reference engine, slowdowns against it and against the baseline records
+def check(records, reference, threshold, compare='full', baseline=None):
+    problems = []
+    by_run = defaultdict(dict)
+    for record in records:
+        by_run[(record['kb'], record['method'])][record['engine']] = record
+    for (kb, method), runs in by_run.items():
+        expected = runs[reference]
+        for engine, record in runs.items():
+            if engine == reference:
+                continue
+            if answer_key(record['answer'], compare) != answer_key(expected['answer'], compare):
+                problems.append(f"MISMATCH {kb} {method}: {engine} says {record['answer']!r}, {reference} says {expected['answer']!r}")
+            elif slower(record, expected, threshold):
+                problems.append(f"SLOWER {kb} {method}: {engine} {record['seconds']:.4f}s vs {reference} {expected['seconds']:.4f}s")
+    for record in records:
+        before = (baseline or {}).get((record['engine'], record['kb'], record['method']))
+        if before is None:
+            continue
+        if answer_key(record['answer'], compare) != answer_key(before['answer'], compare):
+            problems.append(f"CHANGED {record['kb']} {record['method']}: {record['engine']} now says {record['answer']!r}, was {before['answer']!r}")
+        elif slower(record, before, threshold):
+            problems.append(f"REGRESSION {record['kb']} {record['method']}: {record['engine']} {record['seconds']:.4f}s, was {before['seconds']:.4f}s")
+    return problems
+
+# A run is slower than another only if it is past the threshold ratio and the gap is more than the noise on either
+def slower(record, reference, threshold):
+    noise = max(MIN_SLOWDOWN, record.get('spread', 0.0), reference.get('spread', 0.0))
+    return record['seconds'] > reference['seconds'] * threshold and record['seconds'] - reference['seconds'] > noise
+
+# Latency (median and worst net seconds per KB) and throughput (clauses per net second) per engine, method and size
+def summary(records):
+    groups = defaultdict(list)
+    for record in records:
+        groups[(record['engine'], record['method'], record['size'])].append(record)
+    lines = [f"{'engine':<18} {'method':<7} {'size':>5} {'kbs':>4} {'median ms':>10} {'max ms':>10} {'clauses/s':>12}"]
+    for (engine, method, size), group in sorted(groups.items()):
+        seconds = [record['seconds'] for record in group]
+        total = sum(seconds)
+        throughput = f"{sum(record['clauses'] for record in group) / total:12.0f}" if total > 0 else f"{'-':>12}"
+        lines.append(f"{engine:<18} {method:<7} {size:>5} {len(group):>4} {statistics.median(seconds) * 1000:10.2f} "
+                     f"{max(seconds) * 1000:10.2f} {throughput}")
+    return "\n".join(lines)
+
+def load_baseline(filename):
+    try:
+        with open(filename) as file:
+            records = json.load(file)
+    except (OSError, ValueError) as error:
+        print(f"Error: cannot read baseline {filename}: {error}")
+        sys.exit(1)
+    return {(record['engine'], record['kb'], record['method']): record for record in records}
+
+def main():
+    options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    engines = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or ENGINES
+    settings = dict(option[2:].split('=', 1) for option in options if '=' in option)
+    if '--help' in options:
+        print("Usage: python compare_engines.py [engine.py ...] [--methods=TT,FC,BC] [--kinds=horn,general] [--sizes=4,8,12]"
+              " [--count=N] [--seed=S] [--corpus=GLOB|none] [--repeat=N] [--timeout=S] [--threshold=X] [--compare=full|answer]"
+              " [--baseline=FILE] [--save=FILE]")
+        sys.exit(1)
+    for engine in engines:
+        if not os.path.isfile(engine):
+            print(f"Error: engine {engine} not found.")
+            sys.exit(1)
+
+    methods = settings.get('methods', 'TT,FC,BC').split(',')
+    kinds = settings.get('kinds', 'horn').split(',')
+    for kind in kinds:
+        if kind not in GENERATORS:
+            print(f"Error: unknown KB kind {kind}, expected one of {', '.join(GENERATORS)}.")
+            sys.exit(1)
+    sizes = [int(size) for size in settings.get('sizes', '4,8,12').split(',')]
+    repeat = int(settings.get('repeat', 3))
+    timeout = float(settings.get('timeout', 60))
+    threshold = float(settings.get('threshold', 1.25))
+    reference = engines[0]
+
+    with tempfile.TemporaryDirectory() as directory:
+        kbs = generate_kbs(directory, kinds, sizes, int(settings.get('count', 5)), settings.get('seed', '0'))
+        if settings.get('corpus') != 'none':
+            kbs += corpus_kbs(settings.get('corpus', CORPUS))
+        records = measure(engines, kbs, methods, repeat, timeout)
+
+    baseline = load_baseline(settings['baseline']) if 'baseline' in settings else None
+    problems = check(records, reference, threshold, settings.get('compare', 'full'), baseline)
+    print(summary(records))
+    for problem in problems:
+        print(problem)
+    print(f"{len(records)} runs, {sum(problem.startswith(('MISMATCH', 'CHANGED')) for problem in problems)} mismatches, "
+          f"{sum(problem.startswith(('SLOWER', 'REGRESSION')) for problem in problems)} slowdowns")
+    if 'save' in settings:
+        with open(settings['save'], 'w') as file:
+            json.dump(records, file, indent=1)
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,40 @@
 import re
 import sys
 import itertools
-from collections import defaultdict, Counter
+import heapq
+import math
+import random
+import statistics
+import time
+import array
+import hashlib
+import secrets
+import shutil
+import json
+import mmap
+import tempfile
+import queue
+import io
+import glob
+import contextlib
+import concurrent.futures
+import signal
+import threading
+import os
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+from collections import defaultdict, Counter, ChainMap, deque
 import networkx as nx
 
+# numpy is only needed by the vectorised evaluation, so it is imported on first use (see load_numpy)
+np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 # Evaluate an expression 
 def evaluate_expression(expression, assignment):
     # Biconditionals
@@ -33,27 +64,129 @@ def evaluate_clause(clause, assignment):
     return evaluate_expression(clause, assignment)
 
 # Parse the input file to extract clauses and query
+# Binary KBs start with this header, followed by the clause count, the clause lengths (int32) and the UTF-8 clauses.
+# A binary KB is only a container for the clause text: loading it skips splitting the file into sections and clauses,
+# but the clauses are stored unparsed, and every engine still parses them as it would a text KB's
+KB_MAGIC = b'IENGKB1\n'
+
+# Libraries already loaded in this process, keyed by path and file version, holding their clauses as a tuple
+kb_cache = {}
+
+def save_kb(clauses, filename):
+    encoded = [clause.encode() for clause in clauses]
+    with open(filename, 'wb') as file:
+        file.write(KB_MAGIC)
+        file.write(array.array('i', [len(encoded)]).tobytes())
+        file.write(array.array('i', map(len, encoded)).tobytes())
+        file.write(b''.join(encoded))
+
+def read_binary_kb(data):
+    count = array.array('i', data[len(KB_MAGIC):len(KB_MAGIC) + 4])[0]
+    lengths = array.array('i', data[len(KB_MAGIC) + 4:len(KB_MAGIC) + 4 + 4 * count])
+    position, clauses = len(KB_MAGIC) + 4 + 4 * count, []
+    for length in lengths:
+        clauses.append(data[position:position + length].decode())
+        position += length
+    return tuple(clauses)
+
+# Split a KB file into its TELL clauses, INCLUDE paths (in order, relative to the file) and ASK query.
+# TELL, ASK and INCLUDE are keywords wherever they stand as whole words, so a KB may sit on one line and a file may
+# have any number of TELL blocks. An INCLUDE takes the rest of its line as the path. Text before the first keyword
+# (a header comment, say) is ignored, as it always was
+def read_text_kb(text, directory):
+    pieces = re.split(r'\b(TELL|ASK|INCLUDE)\b', text)
+    stray = []
+    parts = []
+    for keyword, value in zip(pieces[1::2], pieces[2::2]):
+        if keyword == 'INCLUDE':
+            path, _, rest = value.strip().partition('\n')
+            parts.append(['INCLUDE', os.path.join(directory, path.strip())])
+            stray.append(rest)
+        else:
+            parts.append([keyword, value])
+    for text in stray:
+        if text.strip():
+            print(f"Error: Incorrect file format. Text outside a TELL or ASK section: {text.strip().splitlines()[0]}")
+            sys.exit(1)
+    return parts
+
+# Load a KB file (text or binary) with all of its includes. Each library is parsed once per process and then reused
+# from kb_cache, and a library is merged into a KB at most once however many files include it
+def load_kb(filename, loaded=None, stack=()):
+    loaded = set() if loaded is None else loaded
+    path = os.path.realpath(filename)
+    if path in stack:
+        print(f"Error: {filename} includes itself.")
+        sys.exit(1)
+    if path in loaded:
+        return [], []
+    loaded.add(path)
+
+    try:
+        info = os.stat(path)
+    except OSError as error:
+        print(f"Error: cannot read {filename}: {error.strerror}.")
+        sys.exit(1)
+    key = (path, info.st_mtime_ns, info.st_size)
+    if key not in kb_cache:
+        with open(path, 'rb') as file:
+            data = file.read()
+        if data.startswith(KB_MAGIC):
+            kb_cache[key] = [('TELL', read_binary_kb(data))]
+        else:
+            kb_cache[key] = [(keyword, tuple(clause.strip() for clause in value.split(';') if clause.strip()) if keyword == 'TELL' else value)
+                             for keyword, value in read_text_kb(data.decode(), os.path.dirname(path))]
+
+    clauses, queries = [], []
+    for keyword, value in kb_cache[key]:
+        if keyword == 'TELL':
+            clauses.extend(value)
+        elif keyword == 'ASK':
+            queries.append(value.strip())
+        else:
+            clauses.extend(load_kb(value, loaded, stack + (path,))[0])
+    return clauses, queries
+
 def parse_input(filename):
-    # Read the content of the file and split the sections based on 'ASK'
-    with open(filename, 'r') as file:
-        content = file.read().split('ASK')
-    
-    if len(content) < 2:
+    clauses, queries = load_kb(filename)
+    with open(filename, 'rb') as file:
+        binary = file.read(len(KB_MAGIC)) == KB_MAGIC
+    if not binary and not any(queries):
         print("Error: Incorrect file format. 'ASK' section not found.")
         sys.exit(1)
-        
-    kb_section = content[0].strip()
-    if 'TELL' not in kb_section:
-        print("Error: Incorrect file format. 'TELL' section not found.")
-        sys.exit(1)
-        
-    kb_raw = kb_section.split('TELL')[1].strip()
-    query = content[1].strip()
-    clauses = [clause.strip() for clause in kb_raw.split(';') if clause.strip()]
-    
+    if len(queries) > 1:
+        print(f"Warning: {filename} has {len(queries)} ASK sections, only the first query is answered "
+              "(give more queries on the command line).", file=sys.stderr)
+
     #print("Parsed clauses:", clauses) #Debug uncomment to see the parsed clauses
-    #print("Parsed query:", query) #Debug uncomment to see the parsed clauses and query
-    return clauses, query
+    #print("Parsed query:", queries) #Debug uncomment to see the parsed clauses and query
+    return clauses, queries[0] if queries else None
+
+# Parse an expression into a nested tuple, splitting exactly the way evaluate_expression does
+def parse_expression(expression):
+    if '<=>' in expression:
+        part1, part2 = expression.split('<=>')
+        return ('<=>', parse_expression(part1.strip()), parse_expression(part2.strip()))
+    elif '=>' in expression:
+        antecedent, consequent = expression.split('=>')
+        return ('=>', parse_expression(antecedent.strip()), parse_expression(consequent.strip()))
+    elif '||' in expression:
+        return ('||',) + tuple(parse_expression(part.strip()) for part in expression.split('||'))
+    elif '&' in expression:
+        return ('&',) + tuple(parse_expression(part.strip()) for part in expression.split('&'))
+    elif expression.startswith('~'):
+        return ('~', parse_expression(expression[1:].strip()))
+    else:
+        return ('atom', expression)
+
+# Collect the propositions a parsed expression actually looks up in the assignment
+def expression_symbols(node):
+    if node[0] == 'atom':
+        return {node[1]}
+    symbols = set()
+    for child in node[1:]:
+        symbols |= expression_symbols(child)
+    return symbols
 
 # Extract symbols from the knowledge base
 def extract_symbols(knowledge_base):
@@ -67,55 +200,1690 @@ def extract_symbols(knowledge_base):
             symbols.add(part.strip())
     return symbols
 
+# Raised from an engine's hot loop when its budget runs out; result() turns it into the UNKNOWN answer
+class BudgetExceeded(Exception):
+    def __init__(self, reason, budget):
+        super().__init__(reason)
+        self.reason = reason
+        self.budget = budget
 
-# Truth Table Method
-def TT(kb, query):
-    symbols = sorted(extract_symbols(kb + [query]))
-    truth_table = list(itertools.product([False, True], repeat=len(symbols)))
-    symbol_list = list(symbols)
-     #print("Symbols:", symbols)  # Debug verify the extracted symbols
-    
+    def result(self, **partial):
+        stats = [f"{self.budget.elapsed():.2f}s", f"{self.budget.steps} steps"]
+        stats += [f"{value} {name.replace('_', ' ')}" for name, value in partial.items()]
+        return f"UNKNOWN: {self.reason} ({', '.join(stats)})"
+
+# Resident size of this process now, in bytes. Where there is no /proc this falls back to the peak resident size
+def resident_memory():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        # ru_maxrss is in KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+# Limits on wall time (seconds), steps (models, search nodes, agenda pops or conflicts, depending on the engine)
+# and memory (MB, on top of what the process held when the budget was made, so imports and earlier queries in the
+# same process do not count) for one engine run. Engines call step() in their hot loop; the limits and the cancel
+# event are only looked at every CHECK_EVERY steps, so the check costs next to nothing
+class Budget:
+    CHECK_EVERY = 1024
+
+    def __init__(self, time_limit=None, max_steps=None, max_memory=None, cancel_event=None):
+        self.start = time.monotonic()
+        self.deadline = self.start + time_limit if time_limit is not None else None
+        self.max_steps = max_steps
+        self.max_memory = max_memory
+        self.base_memory = resident_memory() if max_memory is not None else 0
+        self.cancel_event = cancel_event or threading.Event()
+        self.steps = 0
+        self.next_check = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def step(self, n=1):
+        self.steps += n
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        self.next_check = self.steps + self.CHECK_EVERY
+        if self.max_steps is not None:
+            if self.steps > self.max_steps:
+                raise BudgetExceeded("step limit reached", self)
+            self.next_check = min(self.next_check, self.max_steps + 1)
+        if self.cancel_event.is_set():
+            raise BudgetExceeded("cancelled", self)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded("time limit reached", self)
+        if self.max_memory is not None:
+            if resident_memory() - self.base_memory > self.max_memory * 1024 * 1024:
+                raise BudgetExceeded("memory limit reached", self)
+
+# Worker processes are forked from main() and would inherit its handlers, which only set the cancel event, so
+# terminate() could not stop them. A worker takes SIGTERM by default again, and ignores Ctrl-C, which reaches the
+# whole process group: the parent cancels it through its own cancel event and collects what it got done
+def worker_signals():
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# Count the models of a group of clauses, and the models where the query is also true
+def count_models(clauses, symbols, query=None, budget=None):
     models_where_kb_and_query_true = 0
     models_where_kb_true = 0
 
-    for assignment_values in truth_table:
-        assignment = dict(zip(symbol_list, assignment_values))
-        kb_truth_values = [evaluate_clause(clause, assignment) for clause in kb]
-        query_truth_value = evaluate_clause(query, assignment)
-        # print(f"Assignment: {assignment}, KB Truths: {kb_truth_values}, Query: {query_truth_value}") #Debug to see the results for each model
- 
-        if all(kb_truth_values):
+    for assignment_values in itertools.product([False, True], repeat=len(symbols)):
+        if budget is not None:
+            budget.step()
+        assignment = dict(zip(symbols, assignment_values))
+        if all(evaluate_clause(clause, assignment) for clause in clauses):
             models_where_kb_true += 1
-            if query_truth_value:
+            if query is None or evaluate_clause(query, assignment):
                 models_where_kb_and_query_true += 1
 
-    #print(f"Models where KB is true: {models_where_kb_true}, Models where both KB and Query are true: {models_where_kb_and_query_true}") #Debug to see the final counts
+    return models_where_kb_true, models_where_kb_and_query_true
+
+# Count models like count_models, but walk them in Gray-code order so each step flips a single symbol
+def count_models_gray(clauses, symbols, query=None, budget=None):
+    assignment = dict.fromkeys(symbols, False)
+    clause_values = [evaluate_clause(clause, assignment) for clause in clauses]
+    query_value = query is None or evaluate_clause(query, assignment)
+    false_clauses = clause_values.count(False)
+
+    # Index which clauses (and whether the query) mention each symbol, so a flip only re-evaluates those
+    symbol_set = set(symbols)
+    occurrences = {symbol: [] for symbol in symbols}
+    for i, clause in enumerate(clauses):
+        for symbol in expression_symbols(parse_expression(clause)) & symbol_set:
+            occurrences[symbol].append(i)
+    query_symbols = expression_symbols(parse_expression(query)) if query is not None else set()
+
+    models_where_kb_and_query_true = 0
+    models_where_kb_true = 0
+    if false_clauses == 0:
+        models_where_kb_true += 1
+        models_where_kb_and_query_true += query_value
+
+    for step in range(1, 2 ** len(symbols)):
+        if budget is not None:
+            budget.step()
+        # The bit that changes between consecutive Gray codes is the lowest set bit of the step number
+        symbol = symbols[(step & -step).bit_length() - 1]
+        assignment[symbol] = not assignment[symbol]
+        for i in occurrences[symbol]:
+            value = evaluate_clause(clauses[i], assignment)
+            if value != clause_values[i]:
+                clause_values[i] = value
+                false_clauses += -1 if value else 1
+        if symbol in query_symbols:
+            query_value = evaluate_clause(query, assignment)
+
+        if false_clauses == 0:
+            models_where_kb_true += 1
+            models_where_kb_and_query_true += query_value
+
+    return models_where_kb_true, models_where_kb_and_query_true
+
+# Parsed expressions stored as a hash-consed DAG: structurally equal subformulas anywhere in the KB or the query
+# become one node. A node is only added after its children, so the node list is already in topological order
+class FormulaDAG:
+    def __init__(self):
+        self.ids = {}
+        self.nodes = []
+        self.parents = []
+
+    def add(self, node):
+        key = node if node[0] == 'atom' else (node[0],) + tuple(self.add(child) for child in node[1:])
+        if key not in self.ids:
+            self.ids[key] = len(self.nodes)
+            self.nodes.append(key)
+            self.parents.append([])
+            if key[0] != 'atom':
+                for child in set(key[1:]):
+                    self.parents[child].append(self.ids[key])
+        return self.ids[key]
+
+    def compute(self, i, values, assignment):
+        node = self.nodes[i]
+        op = node[0]
+        if op == 'atom':
+            return assignment.get(node[1], False)
+        elif op == '&':
+            return all(values[child] for child in node[1:])
+        elif op == '||':
+            return any(values[child] for child in node[1:])
+        elif op == '~':
+            return not values[node[1]]
+        elif op == '=>':
+            return not values[node[1]] or values[node[2]]
+        else:
+            return values[node[1]] == values[node[2]]
+
+    # Every node whose value can depend on node i, in topological order
+    def cone(self, i):
+        seen = set()
+        stack = [i]
+        while stack:
+            for parent in self.parents[stack.pop()]:
+                if parent not in seen:
+                    seen.add(parent)
+                    stack.append(parent)
+        return [i] + sorted(seen)
+
+# Count models in Gray-code order over the formula DAG: flipping a symbol recomputes only the nodes above its atom,
+# each once and children first, so a subformula shared by many clauses is evaluated once per model
+def count_models_dag(clauses, symbols, query=None, budget=None):
+    dag = FormulaDAG()
+    roots = Counter(dag.add(parse_expression(clause)) for clause in clauses)
+    query_root = dag.add(parse_expression(query)) if query is not None else None
+    assignment = dict.fromkeys(symbols, False)
+    values = []
+    for i in range(len(dag.nodes)):
+        values.append(dag.compute(i, values, assignment))
+    # Symbols the DAG never looks up are free and have an empty cone
+    cones = [dag.cone(dag.ids[('atom', symbol)]) if ('atom', symbol) in dag.ids else [] for symbol in symbols]
+    false_clauses = sum(count for root, count in roots.items() if not values[root])
+
+    models_where_kb_and_query_true = 0
+    models_where_kb_true = 0
+    if false_clauses == 0:
+        models_where_kb_true += 1
+        models_where_kb_and_query_true += query_root is None or values[query_root]
+
+    for step in range(1, 2 ** len(symbols)):
+        if budget is not None:
+            budget.step()
+        position = (step & -step).bit_length() - 1
+        assignment[symbols[position]] = not assignment[symbols[position]]
+        for i in cones[position]:
+            value = dag.compute(i, values, assignment)
+            if value != values[i]:
+                values[i] = value
+                if i in roots:
+                    false_clauses += -roots[i] if value else roots[i]
+
+        if false_clauses == 0:
+            models_where_kb_true += 1
+            models_where_kb_and_query_true += query_root is None or values[query_root]
+
+    return models_where_kb_true, models_where_kb_and_query_true
+
+# Generated counting functions, keyed by a hash of the clauses, symbols and query they were compiled from
+compiled_kbs = {}
+
+# Compile a group of clauses and the query into one Python function that enumerates the truth table itself: every
+# node of the formula DAG becomes one local assignment per model, in topological order, over locals for the symbols
+def compile_kb(clauses, symbols, query=None, budget=False):
+    key = hashlib.sha256(repr((clauses, symbols, query, budget)).encode()).hexdigest()
+    if key in compiled_kbs:
+        return compiled_kbs[key]
+    dag = FormulaDAG()
+    roots = [dag.add(parse_expression(clause)) for clause in clauses]
+    query_root = dag.add(parse_expression(query)) if query is not None else None
+    names = {symbol: f"v{i}" for i, symbol in enumerate(symbols)}
+    lines = []
+    for i, node in enumerate(dag.nodes):
+        op = node[0]
+        if op == 'atom':
+            # Atoms that are not symbols read as False like in evaluate_expression
+            expression = names.get(node[1], 'False')
+        elif op == '&':
+            expression = ' and '.join(f"n{child}" for child in node[1:])
+        elif op == '||':
+            expression = ' or '.join(f"n{child}" for child in node[1:])
+        elif op == '~':
+            expression = f"not n{node[1]}"
+        elif op == '=>':
+            expression = f"not n{node[1]} or n{node[2]}"
+        else:
+            expression = f"n{node[1]} == n{node[2]}"
+        lines.append(f"        n{i} = {expression}")
+    kb_value = ' and '.join(f"n{root}" for root in dict.fromkeys(roots)) or 'True'
+    query_value = f"n{query_root}" if query_root is not None else 'True'
+    unpack = ''.join(f"{names[symbol]}, " for symbol in symbols) or '_'
+    source = '\n'.join([
+        "def count(models, step):",
+        "    models_where_kb_true = 0",
+        "    models_where_kb_and_query_true = 0",
+        f"    for {unpack} in models:",
+        *(["        step()"] if budget else []),
+        *lines,
+        f"        if {kb_value}:",
+        "            models_where_kb_true += 1",
+        f"            if {query_value}:",
+        "                models_where_kb_and_query_true += 1",
+        "    return models_where_kb_true, models_where_kb_and_query_true",
+    ])
+    #print(source) # Debug uncomment to see the generated code
+    namespace = {}
+    exec(compile(source, f"<kb {key[:12]}>", 'exec'), namespace)
+    compiled_kbs[key] = namespace['count']
+    return compiled_kbs[key]
+
+# Count models like count_models, with the whole KB compiled into one generated function
+def count_models_compiled(clauses, symbols, query=None, budget=None):
+    count = compile_kb(clauses, symbols, query, budget is not None)
+    models = itertools.product([False, True], repeat=len(symbols)) if symbols else [()]
+    return count(models, budget.step if budget is not None else None)
+
+# A parsed expression with its symbols renamed through mapping and the operands of &, || and <=> sorted, so two
+# expressions that only differ in operand order compare equal
+def canonical_expression(node, mapping):
+    op = node[0]
+    if op == 'atom':
+        return ('atom', mapping.get(node[1], node[1]))
+    children = tuple(canonical_expression(child, mapping) for child in node[1:])
+    if op in ('&', '||', '<=>'):
+        children = tuple(sorted(children))
+    return (op,) + children
+
+# Group the symbols into classes of interchangeable ones: swapping any two symbols of a class maps the set of KB
+# clauses and the query onto themselves. Colour refinement (Weisfeiler-Lehman) on the clause/literal graph rules
+# out most pairs, and each remaining swap is checked exactly. Swaps that are symmetries make an equivalence
+# relation, so every symbol only has to be tried against one member of each class
+def symmetry_classes(clauses, symbols, query=None):
+    trees = [parse_expression(clause) for clause in clauses]
+    query_tree = parse_expression(query) if query is not None else None
+    symbol_set = set(symbols)
+    graph = nx.Graph()
+    # The root is there even for a component with no clauses and no query
+    graph.add_node('kb', label='kb')
+    for symbol in symbols:
+        graph.add_node(('symbol', symbol), label='symbol')
+
+    def add(node, parent, role):
+        node_id = ('node', graph.number_of_nodes())
+        if node[0] == 'atom':
+            graph.add_node(node_id, label='atom' if node[1] in symbol_set else 'false')
+            if node[1] in symbol_set:
+                graph.add_edge(node_id, ('symbol', node[1]), role='name')
+        else:
+            graph.add_node(node_id, label=node[0])
+            for i, child in enumerate(node[1:]):
+                add(child, node_id, str(i) if node[0] == '=>' else 'operand')
+        graph.add_edge(parent, node_id, role=role)
+
+    for tree in trees:
+        add(tree, 'kb', 'clause')
+    if query_tree is not None:
+        add(query_tree, 'kb', 'query')
+    colours = nx.weisfeiler_lehman_subgraph_hashes(graph, node_attr='label', edge_attr='role', iterations=4)
+
+    forms = {canonical_expression(tree, {}) for tree in trees}
+    query_form = canonical_expression(query_tree, {}) if query_tree is not None else None
+
+    def symmetric(a, b):
+        swap = {a: b, b: a}
+        if query_tree is not None and canonical_expression(query_tree, swap) != query_form:
+            return False
+        return {canonical_expression(tree, swap) for tree in trees} == forms
+
+    classes = []
+    for symbol in symbols:
+        for members in classes:
+            if colours[('symbol', symbol)] == colours[('symbol', members[0])] and symmetric(symbol, members[0]):
+                members.append(symbol)
+                break
+        else:
+            classes.append([symbol])
+    return classes
+
+# Count models like count_models, but only over one assignment per orbit of the symmetry classes: within a class
+# only the number of true symbols matters, so an assignment with j of a class's k symbols true stands for C(k, j)
+def count_models_symmetric(clauses, symbols, query=None, budget=None):
+    classes = symmetry_classes(clauses, symbols, query)
+    #print("Symmetry classes:", [members for members in classes if len(members) > 1]) # Debug uncomment to see the classes
+    dag = FormulaDAG()
+    roots = [dag.add(parse_expression(clause)) for clause in clauses]
+    query_root = dag.add(parse_expression(query)) if query is not None else None
+
+    models_where_kb_and_query_true = 0
+    models_where_kb_true = 0
+    for trues in itertools.product(*(range(len(members) + 1) for members in classes)):
+        if budget is not None:
+            budget.step()
+        assignment = {}
+        weight = 1
+        for members, true_count in zip(classes, trues):
+            weight *= math.comb(len(members), true_count)
+            for i, symbol in enumerate(members):
+                assignment[symbol] = i < true_count
+        values = []
+        for i in range(len(dag.nodes)):
+            values.append(dag.compute(i, values, assignment))
+        if all(values[root] for root in roots):
+            models_where_kb_true += weight
+            if query_root is None or values[query_root]:
+                models_where_kb_and_query_true += weight
+
+    return models_where_kb_true, models_where_kb_and_query_true
+
+# Evaluate a parsed expression under a partial assignment: True, False, or None while it is still undecided
+def evaluate_partial(node, assignment):
+    op = node[0]
+    if op == 'atom':
+        # Symbols still unassigned map to None; anything that is not a symbol reads as False like in evaluate_expression
+        return assignment.get(node[1], False)
+    elif op == '~':
+        value = evaluate_partial(node[1], assignment)
+        return None if value is None else not value
+    elif op == '&':
+        values = [evaluate_partial(child, assignment) for child in node[1:]]
+        if False in values:
+            return False
+        return True if None not in values else None
+    elif op == '||':
+        values = [evaluate_partial(child, assignment) for child in node[1:]]
+        if True in values:
+            return True
+        return False if None not in values else None
+    elif op == '=>':
+        antecedent = evaluate_partial(node[1], assignment)
+        consequent = evaluate_partial(node[2], assignment)
+        if antecedent is False or consequent is True:
+            return True
+        return False if antecedent is True and consequent is False else None
+    else:
+        part1 = evaluate_partial(node[1], assignment)
+        part2 = evaluate_partial(node[2], assignment)
+        return None if part1 is None or part2 is None else part1 == part2
+
+# Count models like count_models, but with a recursive search over partial assignments that prunes any branch
+# where a clause is already false, propagates forced (unit) assignments and counts finished branches as 2^k models
+def count_models_pruned(clauses, symbols, query=None, budget=None, cube=None):
+    assignment = dict.fromkeys(symbols, None)
+    # A cube fixes some symbols up front, and only the models that agree with it are counted
+    assignment.update(cube or {})
+    trees = [parse_expression(clause) for clause in clauses]
+    clause_symbols = [sorted(expression_symbols(tree) & set(symbols)) for tree in trees]
+    query_tree = parse_expression(query) if query is not None else None
+    query_symbols = sorted(expression_symbols(query_tree) & set(symbols)) if query is not None else []
+
+    def search(unassigned):
+        if budget is not None:
+            budget.step()
+        trail = []
+
+        def undo(result):
+            for symbol in trail:
+                assignment[symbol] = None
+            return result
+
+        # Unit propagation: a clause with one open symbol that one value would falsify forces the other value
+        while True:
+            open_clauses = []
+            forced = False
+            for tree, tree_symbols in zip(trees, clause_symbols):
+                value = evaluate_partial(tree, assignment)
+                if value is False:
+                    return undo((0, 0))
+                if value is None:
+                    free = [symbol for symbol in tree_symbols if assignment[symbol] is None]
+                    if len(free) == 1:
+                        assignment[free[0]] = True
+                        if_true = evaluate_partial(tree, assignment)
+                        assignment[free[0]] = False
+                        if_false = evaluate_partial(tree, assignment)
+                        if if_true is False and if_false is False:
+                            assignment[free[0]] = None
+                            return undo((0, 0))
+                        if if_true is False or if_false is False:
+                            assignment[free[0]] = if_true is not False
+                            trail.append(free[0])
+                            forced = True
+                            continue
+                        assignment[free[0]] = None
+                    open_clauses.append(tree_symbols)
+            if not forced:
+                break
+        unassigned -= len(trail)
+
+        # Once every clause is true, the remaining symbols are free unless the query still depends on them
+        if not open_clauses:
+            query_value = True if query_tree is None else evaluate_partial(query_tree, assignment)
+            if query_value is not None:
+                return undo((2 ** unassigned, 2 ** unassigned if query_value else 0))
+            open_clauses = [query_symbols]
+
+        # Branch on the open symbol that appears in the most undecided clauses
+        occurrences = Counter(symbol for tree_symbols in open_clauses for symbol in tree_symbols if assignment[symbol] is None)
+        symbol = max(sorted(occurrences), key=occurrences.get)
+        models_where_kb_true, models_where_kb_and_query_true = 0, 0
+        for value in (False, True):
+            assignment[symbol] = value
+            kb_models, kb_and_query_models = search(unassigned - 1)
+            models_where_kb_true += kb_models
+            models_where_kb_and_query_true += kb_and_query_models
+        assignment[symbol] = None
+        return undo((models_where_kb_true, models_where_kb_and_query_true))
+
+    return search(len(symbols) - len(cube or {}))
+
+# Import numpy the first time a vectorised evaluation needs it, keeping it off the start-up of every other run
+def load_numpy(user):
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError(f"{user} needs numpy")
+        np = numpy
+    return np
+
+# Evaluate a parsed expression for every row of a batch at once; columns maps each symbol to its boolean column.
+# Identical subformulas are only computed once per batch through the cache
+def evaluate_node_batch(node, columns, rows, cache):
+    if node in cache:
+        return cache[node]
+    op = node[0]
+    if op == 'atom':
+        value = columns[node[1]] if node[1] in columns else np.zeros(rows, dtype=bool)
+    elif op == '~':
+        value = ~evaluate_node_batch(node[1], columns, rows, cache)
+    elif op == '&':
+        value = np.logical_and.reduce([evaluate_node_batch(child, columns, rows, cache) for child in node[1:]])
+    elif op == '||':
+        value = np.logical_or.reduce([evaluate_node_batch(child, columns, rows, cache) for child in node[1:]])
+    elif op == '=>':
+        value = ~evaluate_node_batch(node[1], columns, rows, cache) | evaluate_node_batch(node[2], columns, rows, cache)
+    else:
+        value = evaluate_node_batch(node[1], columns, rows, cache) == evaluate_node_batch(node[2], columns, rows, cache)
+    cache[node] = value
+    return value
+
+# Evaluate the KB and the query against an N x len(symbols) boolean matrix of assignments (one model per row,
+# columns in the order of symbols), e.g. observed configurations. Returns the per-row truth of the whole KB and
+# of the query (None when no query is given)
+def evaluate_batch(kb, query, symbols, assignments):
+    load_numpy("evaluate_batch")
+    assignments = np.asarray(assignments, dtype=bool)
+    if assignments.ndim != 2 or assignments.shape[1] != len(symbols):
+        raise ValueError(f"expected an N x {len(symbols)} matrix of assignments, got shape {assignments.shape}")
+    rows = assignments.shape[0]
+    columns = {symbol: assignments[:, i] for i, symbol in enumerate(symbols)}
+    cache = {}
+    kb_values = np.ones(rows, dtype=bool)
+    for clause in kb:
+        kb_values &= evaluate_node_batch(parse_expression(clause), columns, rows, cache)
+    query_values = evaluate_node_batch(parse_expression(query), columns, rows, cache) if query is not None else None
+    return kb_values, query_values
+
+# Rows of the truth table handed to evaluate_batch at a time
+BATCH_ROWS = 1 << 16
+
+# Count models like count_models, evaluating the truth table in vectorised blocks of rows
+def count_models_vector(clauses, symbols, query=None, budget=None):
+    models_where_kb_and_query_true = 0
+    models_where_kb_true = 0
+    load_numpy("the vector enumeration")
+    shifts = np.arange(len(symbols), dtype=np.int64)
+    for start in range(0, 2 ** len(symbols), BATCH_ROWS):
+        rows = np.arange(start, min(start + BATCH_ROWS, 2 ** len(symbols)), dtype=np.int64)
+        if budget is not None:
+            budget.step(len(rows))
+        kb_values, query_values = evaluate_batch(clauses, query, symbols, (rows[:, None] >> shifts) & 1)
+        models_where_kb_true += int(kb_values.sum())
+        models_where_kb_and_query_true += int((kb_values & query_values).sum()) if query is not None else int(kb_values.sum())
+    return models_where_kb_true, models_where_kb_and_query_true
+
+# Split the KB into groups of clauses that share no symbols with each other
+def kb_components(kb, query, symbols, budget=None):
+    graph = nx.Graph()
+    graph.add_nodes_from(symbols)
+    known = set(symbols)
+    clause_symbols = {}
+    for clause in kb + [query]:
+        if budget is not None:
+            budget.step()
+        if clause not in clause_symbols:
+            # Atoms that are not in the symbol list always evaluate to False, so they do not link clauses
+            clause_symbols[clause] = sorted(expression_symbols(parse_expression(clause)) & known)
+            nx.add_path(graph, clause_symbols[clause])
+
+    # One pass over the KB puts each clause in the component of its first symbol
+    components = []
+    component_ids = {}
+    for component in nx.connected_components(graph):
+        for symbol in component:
+            component_ids[symbol] = len(components)
+        components.append((sorted(component), []))
+    constant_clauses = []
+    for clause in kb:
+        if clause_symbols[clause]:
+            components[component_ids[clause_symbols[clause][0]]][1].append(clause)
+        else:
+            constant_clauses.append(clause)
+    query_symbols = set(clause_symbols[query])
+    return components, constant_clauses, query_symbols
+
+# Ways of counting the models of one component
+# 'dag' flips one symbol per model and recomputes only the shared subformulas above it, 'compiled' runs the KB as one
+# generated Python function per component, 'gray' re-evaluates the clause strings that mention the flipped symbol,
+# 'symmetric' only visits one model per orbit of interchangeable symbols, 'table' rebuilds every row,
+# 'pruned' searches partial assignments and skips whole subtrees that are already decided, 'vector' evaluates
+# blocks of rows with numpy
+ENUMERATIONS = {'table': count_models, 'gray': count_models_gray, 'dag': count_models_dag, 'compiled': count_models_compiled, 'symmetric': count_models_symmetric, 'pruned': count_models_pruned, 'vector': count_models_vector}
+
+# Truth Table Method
+# With preprocess=True the KB is simplified first (see Preprocessed), which keeps the answer and the model count
+# With a checkpoint (a CheckpointedCount) the models are counted by it instead, so the run can be resumed
+def TT(kb, query, enumeration='dag', budget=None, preprocess=False, checkpoint=None):
+    count = checkpoint or ENUMERATIONS[enumeration]
+    try:
+        if preprocess:
+            return preprocessed_truth_table(kb, query, count, budget)
+        return truth_table(kb, query, count, budget)
+    except BudgetExceeded as error:
+        return error.result()
+
+def truth_table(kb, query, count, budget, multiplier=1):
+    symbols = sorted(extract_symbols(kb + [query]))
+    components, constant_clauses, query_symbols = kb_components(kb, query, symbols, budget)
+    #print("Components:", components)  # Debug verify the variable-disjoint components
+
+    # Clauses without any symbols are either true in every model or in none
+    if not all(evaluate_clause(clause, {}) for clause in constant_clauses):
+        return "NO"
+
+    # Components away from the query only scale the model count, so count them first (smallest first) and stop on the first unsatisfiable one
+    query_component = ([], [])
+    for component_symbols, clauses in sorted(components, key=lambda component: len(component[0])):
+        if query_symbols & set(component_symbols):
+            query_component = (component_symbols, clauses)
+            continue
+        component_models, _ = count(clauses, component_symbols, budget=budget)
+        if component_models == 0:
+            return "NO"
+        multiplier *= component_models
+
+    # Only the component holding the query has to be enumerated for entailment
+    models_where_kb_true, models_where_kb_and_query_true = count(query_component[1], query_component[0], query, budget)
+
+    #print(f"Models where KB is true: {models_where_kb_true * multiplier}, Models where both KB and Query are true: {models_where_kb_and_query_true * multiplier}") #Debug to see the final counts
     if models_where_kb_true > 0 and models_where_kb_and_query_true == models_where_kb_true:
-        return f"YES: {models_where_kb_and_query_true}"
+        return f"YES: {models_where_kb_and_query_true * multiplier}"
     else:
         return "NO"
 
+# Models per checkpointed block are 2^CHECKPOINT_BLOCK_BITS, and progress is written at most every CHECKPOINT_EVERY seconds
+CHECKPOINT_BLOCK_BITS = 16
+CHECKPOINT_EVERY = 30.0
+
+# Count one shard of a component's truth table: blocks start..end of 2^b models each, where block i fixes the
+# leading symbols to the bits of i. Progress (next block and the counts so far) is saved to path as it goes and when
+# the budget runs out, so the shard can carry on from there
+def count_shard(path, state, clauses, symbols, query, budget, every=CHECKPOINT_EVERY):
+    bits = min(len(symbols), CHECKPOINT_BLOCK_BITS)
+    count = compile_kb(clauses, symbols, query)
+    low = [[False, True]] * bits
+    saved = time.monotonic()
+    try:
+        while state['next'] < state['end']:
+            prefix = [[bool(state['next'] >> i & 1)] for i in reversed(range(len(symbols) - bits))]
+            kb_models, kb_and_query_models = count(itertools.product(*prefix, *low), None)
+            state['kb'] += kb_models
+            state['both'] += kb_and_query_models
+            state['next'] += 1
+            if time.monotonic() - saved > every:
+                save_checkpoint(path, state)
+                saved = time.monotonic()
+            if budget is not None:
+                budget.step(2 ** bits)
+    finally:
+        save_checkpoint(path, state)
+    return state
+
+def save_checkpoint(path, state):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file)
+    os.replace(path + '.tmp', path)
+
+def checkpoint_shard_worker(path, state, clauses, symbols, query, time_limit, cancel_event):
+    worker_signals()
+    try:
+        count_shard(path, state, clauses, symbols, query, Budget(time_limit=time_limit, cancel_event=cancel_event))
+    except BudgetExceeded:
+        pass
+
+# A model counter (used by truth_table in place of an enumeration) that keeps its progress in directory, one file
+# per shard of each component it counts, named by a hash of the component's clauses, symbols and query. With
+# resume=True shards that finished are taken from their files and unfinished ones carry on from their last
+# checkpoint; otherwise every count starts over. Shards run in up to workers processes at once
+class CheckpointedCount:
+    def __init__(self, directory, shards=1, workers=1, resume=False):
+        self.directory = directory
+        self.shards = shards
+        self.workers = workers
+        self.resume = resume
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, clauses, symbols, query=None, budget=None):
+        key = hashlib.sha256(repr((clauses, symbols, query)).encode()).hexdigest()
+        blocks = 2 ** (len(symbols) - min(len(symbols), CHECKPOINT_BLOCK_BITS))
+        shards = min(self.shards, blocks)
+        states = []
+        for shard in range(shards):
+            path = os.path.join(self.directory, f"{key[:16]}.{shard}-of-{shards}.json")
+            state = None
+            if self.resume and os.path.exists(path):
+                with open(path) as file:
+                    state = json.load(file)
+                if state.get('kb_hash') != key:
+                    state = None
+            if state is None:
+                state = {'kb_hash': key, 'start': blocks * shard // shards, 'end': blocks * (shard + 1) // shards,
+                         'kb': 0, 'both': 0}
+                state['next'] = state['start']
+            states.append((path, state))
+
+        unfinished = [(path, state) for path, state in states if state['next'] < state['end']]
+        #print(f"Component {key[:16]}: {len(unfinished)} of {shards} shards left") # Debug uncomment to see what a resume skips
+        if self.workers > 1 and len(unfinished) > 1:
+            self.run_parallel(unfinished, clauses, symbols, query, budget)
+            states = [(path, self.load(path)) for path, _ in states]
+        else:
+            for path, state in unfinished:
+                count_shard(path, state, clauses, symbols, query, budget)
+        return sum(state['kb'] for _, state in states), sum(state['both'] for _, state in states)
+
+    def load(self, path):
+        with open(path) as file:
+            return json.load(file)
+
+    def run_parallel(self, unfinished, clauses, symbols, query, budget):
+        cancel_event = multiprocessing.Event()
+        time_limit = budget.deadline - time.monotonic() if budget is not None and budget.deadline is not None else None
+        pending = list(unfinished)
+        running = []
+        try:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    path, state = pending.pop(0)
+                    process = multiprocessing.Process(target=checkpoint_shard_worker, args=(
+                        path, state, clauses, symbols, query, time_limit, cancel_event))
+                    process.start()
+                    running.append(process)
+                multiprocessing.connection.wait([process.sentinel for process in running], timeout=0.05)
+                running = [process for process in running if process.is_alive()]
+                if budget is not None:
+                    budget.check()
+        finally:
+            cancel_event.set()
+            for process in running:
+                process.join()
+        # A shard whose process was killed before it finished is left for the next resume
+        for path, _ in unfinished:
+            state = self.load(path)
+            if state['next'] < state['end']:
+                raise BudgetExceeded(f"shard {os.path.basename(path)} did not finish", budget or Budget())
+
+# Incremental CDCL SAT solver over integer literals (+v / -v). Clauses can be added between calls to solve(),
+# and solve() takes assumption literals, so learned clauses and activity scores carry over from one call to the next
+class SATSolver:
+    def __init__(self):
+        self.num_vars = 0
+        self.clauses = []
+        self.watches = defaultdict(list)
+        self.value = [None]
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.polarity = [False]
+        self.heap = []
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.var_inc = 1.0
+        self.ok = True
+        self.conflicts = 0
+        # A Budget checked once per conflict and per decision, if set
+        self.budget = None
+
+    def new_var(self):
+        self.num_vars += 1
+        self.value.append(None)
+        self.level.append(0)
+        self.reason.append(None)
+        self.activity.append(0.0)
+        self.polarity.append(False)
+        heapq.heappush(self.heap, (0.0, self.num_vars))
+        return self.num_vars
+
+    def lit_value(self, lit):
+        value = self.value[abs(lit)]
+        if value is None:
+            return None
+        return value if lit > 0 else not value
+
+    # Clauses are only added at decision level 0, where literals already false can be dropped for good
+    def add_clause(self, lits):
+        if not self.ok:
+            return False
+        clause = []
+        for lit in dict.fromkeys(lits):
+            value = self.lit_value(lit)
+            if value is True or -lit in clause:
+                return True
+            if value is None:
+                clause.append(lit)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self.enqueue(clause[0], None)
+            self.ok = self.propagate() is None
+        else:
+            self.attach(clause)
+        return self.ok
+
+    def attach(self, clause):
+        self.clauses.append(clause)
+        self.watches[clause[0]].append(clause)
+        self.watches[clause[1]].append(clause)
+
+    def enqueue(self, lit, reason):
+        v = abs(lit)
+        self.value[v] = lit > 0
+        self.level[v] = len(self.trail_lim)
+        self.reason[v] = reason
+        self.trail.append(lit)
+
+    # Two-watched-literal unit propagation; returns the conflicting clause, or None
+    def propagate(self):
+        value = self.value
+        watches = self.watches
+        trail = self.trail
+        while self.qhead < len(trail):
+            false_lit = -trail[self.qhead]
+            self.qhead += 1
+            watching = watches[false_lit]
+            kept = []
+            for i, clause in enumerate(watching):
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], clause[0]
+                first = clause[0]
+                first_value = value[first if first > 0 else -first]
+                if first_value is not None and first_value == (first > 0):
+                    kept.append(clause)
+                    continue
+                for k in range(2, len(clause)):
+                    lit = clause[k]
+                    lit_value = value[lit if lit > 0 else -lit]
+                    if lit_value is None or lit_value == (lit > 0):
+                        clause[1], clause[k] = lit, false_lit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if first_value is not None:
+                        kept.extend(watching[i + 1:])
+                        watches[false_lit] = kept
+                        return clause
+                    self.enqueue(first, clause)
+            watches[false_lit] = kept
+        return None
+
+    # Drop clauses that are satisfied at decision level 0 (such as ones whose activation literal was retired)
+    # and literals that are false there, so they stop costing anything in the watch lists
+    def simplify(self):
+        if self.trail_lim or not self.ok:
+            return
+        if self.propagate() is not None:
+            self.ok = False
+            return
+        kept = []
+        for clause in self.clauses:
+            if any(self.lit_value(lit) is True for lit in clause):
+                continue
+            clause[:] = [lit for lit in clause if self.lit_value(lit) is None]
+            kept.append(clause)
+        self.clauses = kept
+        self.watches = defaultdict(list)
+        for clause in kept:
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+
+    def bump(self, v):
+        self.activity[v] += self.var_inc
+        if self.activity[v] > 1e100:
+            self.activity = [activity * 1e-100 for activity in self.activity]
+            self.var_inc *= 1e-100
+            self.heap = [(-self.activity[u], u) for u in range(1, self.num_vars + 1)]
+            heapq.heapify(self.heap)
+        else:
+            heapq.heappush(self.heap, (-self.activity[v], v))
+
+    # First-UIP conflict analysis; returns the learned clause (asserting literal first) and the level to jump back to
+    def analyze(self, conflict):
+        seen = set()
+        learnt = [None]
+        counter = 0
+        p = None
+        index = len(self.trail) - 1
+        clause = conflict
+        while True:
+            for q in (clause if p is None else clause[1:]):
+                v = abs(q)
+                if v not in seen and self.level[v] > 0:
+                    seen.add(v)
+                    self.bump(v)
+                    if self.level[v] == len(self.trail_lim):
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            p = self.trail[index]
+            index -= 1
+            counter -= 1
+            if counter == 0:
+                break
+            clause = self.reason[abs(p)]
+        learnt[0] = -p
+        self.var_inc /= 0.95
+        if len(learnt) == 1:
+            return learnt, 0
+        second = max(range(1, len(learnt)), key=lambda i: self.level[abs(learnt[i])])
+        learnt[1], learnt[second] = learnt[second], learnt[1]
+        return learnt, self.level[abs(learnt[1])]
+
+    # Work out which assumptions forced the assumption literal lit to be false; they form the unsat core
+    def analyze_final(self, lit):
+        core = [lit]
+        if not self.trail_lim:
+            return core
+        seen = {abs(lit)}
+        for x in reversed(self.trail[self.trail_lim[0]:]):
+            v = abs(x)
+            if v in seen:
+                if self.reason[v] is None:
+                    core.append(x)
+                else:
+                    for q in self.reason[v][1:]:
+                        if self.level[abs(q)] > 0:
+                            seen.add(abs(q))
+        return core
+
+    def backtrack(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        for lit in self.trail[self.trail_lim[level]:]:
+            v = abs(lit)
+            self.polarity[v] = lit > 0
+            self.value[v] = None
+            self.reason[v] = None
+            heapq.heappush(self.heap, (-self.activity[v], v))
+        del self.trail[self.trail_lim[level]:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+
+    def pick_branch_var(self):
+        while self.heap:
+            _, v = heapq.heappop(self.heap)
+            if self.value[v] is None:
+                return v
+        return None
+
+    # Luby restart sequence 1, 1, 2, 1, 1, 2, 4, ...
+    @staticmethod
+    def luby(i):
+        size, seq = 1, 0
+        while size < i + 1:
+            seq += 1
+            size = 2 * size + 1
+        while size - 1 != i:
+            size = (size - 1) >> 1
+            seq -= 1
+            i = i % size
+        return 2 ** seq
+
+    # Returns True when the clauses are satisfiable with every assumption literal true; self.model then holds the model.
+    # On False, self.core holds the assumptions that were enough for the contradiction
+    def solve(self, assumptions=()):
+        self.model = None
+        self.core = []
+        if not self.ok:
+            return False
+        restarts = 0
+        restart_conflicts = 100 * self.luby(restarts)
+        try:
+            while True:
+                if self.budget is not None:
+                    self.budget.step()
+                conflict = self.propagate()
+                if conflict is not None:
+                    self.conflicts += 1
+                    restart_conflicts -= 1
+                    if not self.trail_lim:
+                        self.ok = False
+                        return False
+                    learnt, level = self.analyze(conflict)
+                    self.backtrack(level)
+                    if len(learnt) == 1:
+                        self.enqueue(learnt[0], None)
+                    else:
+                        self.attach(learnt)
+                        self.enqueue(learnt[0], learnt)
+                    continue
+                if restart_conflicts <= 0:
+                    restarts += 1
+                    restart_conflicts = 100 * self.luby(restarts)
+                    self.backtrack(0)
+                    continue
+                # Assumptions are decided first, one per decision level
+                lit = None
+                while len(self.trail_lim) < len(assumptions):
+                    assumption = assumptions[len(self.trail_lim)]
+                    value = self.lit_value(assumption)
+                    if value is True:
+                        self.trail_lim.append(len(self.trail))
+                    elif value is False:
+                        self.core = self.analyze_final(assumption)
+                        return False
+                    else:
+                        lit = assumption
+                        break
+                if lit is None:
+                    v = self.pick_branch_var()
+                    if v is None:
+                        self.model = list(self.value)
+                        return True
+                    lit = v if self.polarity[v] else -v
+                self.trail_lim.append(len(self.trail))
+                self.enqueue(lit, None)
+        finally:
+            self.backtrack(0)
+
+# Keeps one KB loaded in an incremental SAT solver and answers entailment queries against it.
+# Formulas are Tseitin-encoded with one variable per distinct subformula, so repeated queries reuse their encoding.
+# With selectors=True every KB clause is guarded by its own selector variable, which lets the solver report unsat cores
+class SATSession:
+    def __init__(self, kb, selectors=False):
+        self.kb = kb
+        self.solver = SATSolver()
+        self.literals = {}
+        self.kb_symbols = extract_symbols(kb)
+        self.kb_atoms = set()
+        self.kb_satisfiable = {}
+        self.selectors = {}
+        self.cores = {}
+        self.explainer = None
+        for rule_id, clause in enumerate(kb):
+            tree = parse_expression(clause)
+            self.kb_atoms |= expression_symbols(tree)
+            if selectors:
+                selector = self.solver.new_var()
+                self.selectors[selector] = rule_id
+                self.solver.add_clause([-selector, self.literal(tree)])
+            else:
+                self.solver.add_clause([self.literal(tree)])
+
+    # Return a literal that is equivalent to the parsed expression, adding its defining clauses the first time
+    def literal(self, node):
+        if node in self.literals:
+            return self.literals[node]
+        op = node[0]
+        if op == 'atom':
+            lit = self.solver.new_var()
+        elif op == '~':
+            lit = -self.literal(node[1])
+        else:
+            children = [self.literal(child) for child in node[1:]]
+            lit = self.solver.new_var()
+            add = self.solver.add_clause
+            if op == '&':
+                for child in children:
+                    add([-lit, child])
+                add([lit] + [-child for child in children])
+            elif op == '||':
+                for child in children:
+                    add([lit, -child])
+                add([-lit] + children)
+            elif op == '=>':
+                a, b = children
+                add([-lit, -a, b])
+                add([lit, a])
+                add([lit, -b])
+            else:
+                a, b = children
+                add([-lit, -a, b])
+                add([-lit, a, -b])
+                add([lit, a, b])
+                add([lit, -a, -b])
+        self.literals[node] = lit
+        return lit
+
+    # Assumptions that make the solver see exactly the clauses TT would evaluate for this query
+    def assumptions(self, tree, query):
+        # Atoms that extract_symbols does not pick up never get a value in TT, so they are pinned to False
+        symbols = self.kb_symbols | extract_symbols([query])
+        pinned = sorted(atom for atom in self.kb_atoms | expression_symbols(tree) if atom not in symbols)
+        return [-self.literals[('atom', atom)] for atom in pinned] + sorted(self.selectors)
+
+    def ask(self, query, budget=None):
+        tree = parse_expression(query)
+        query_lit = self.literal(tree)
+        assumptions = self.assumptions(tree, query)
+
+        # Running out of budget leaves the solver at level 0 with only valid learned clauses, so the session stays usable
+        self.solver.budget = budget
+        try:
+            key = tuple(assumptions)
+            if key not in self.kb_satisfiable:
+                self.kb_satisfiable[key] = self.solver.solve(assumptions)
+            # The KB entails the query exactly when the KB has models and none of them falsify the query
+            if self.kb_satisfiable[key] and not self.solver.solve(assumptions + [-query_lit]):
+                return "YES"
+            return "NO"
+        except BudgetExceeded as error:
+            return error.result(conflicts=self.solver.conflicts)
+        finally:
+            self.solver.budget = None
+
+    # Explain a YES answer with a minimal unsat core of KB & ~query, as a proof DAG {rule id: ()} over KB positions
+    def explain(self, query):
+        if not self.selectors:
+            if self.explainer is None:
+                self.explainer = SATSession(self.kb, selectors=True)
+            return self.explainer.explain(query)
+        if query in self.cores:
+            return self.cores[query]
+        proof = None
+        if self.ask(query) == "YES":
+            tree = parse_expression(query)
+            pinned = [lit for lit in self.assumptions(tree, query) if abs(lit) not in self.selectors]
+            query_lit = self.literal(tree)
+            core = sorted(lit for lit in self.solver.core if lit in self.selectors)
+            # Drop every clause the refutation still goes through without
+            for selector in list(core):
+                trial = [lit for lit in core if lit != selector]
+                if not self.solver.solve(pinned + trial + [-query_lit]):
+                    core = [lit for lit in trial if lit in self.solver.core] if self.solver.core else trial
+            proof = {self.selectors[selector]: () for selector in sorted(core, key=self.selectors.get)}
+        self.cores[query] = proof
+        return proof
+
+# SAT Method
+def SAT(kb, query, budget=None, preprocess=False):
+    if preprocess:
+        return preprocessed_sat(kb, query, budget)
+    return SATSession(kb).ask(query, budget)
+
+# Largest CNF one clause (or the query) may expand to before preprocessing gives up and the engines get the KB as written
+PREPROCESS_MAX_CLAUSES = 256
+# Variable elimination only goes ahead if it adds at most this many clauses, and only for variables with few occurrences
+BVE_GROWTH = 0
+BVE_MAX_OCCURRENCES = 16
+
+class CNFTooLarge(Exception):
+    pass
+
+# Clausal form of a parsed expression over symbol ids, as a list of frozensets of +id/-id literals. Atoms that are
+# not symbols read as False like in evaluate_expression, so they become constants
+def expression_cnf(node, symbol_ids, positive=True, budget=None):
+    if budget is not None:
+        budget.step()
+    op = node[0]
+    if op == 'atom':
+        if node[1] not in symbol_ids:
+            return [] if not positive else [frozenset()]
+        return [frozenset([symbol_ids[node[1]] if positive else -symbol_ids[node[1]]])]
+    elif op == '~':
+        return expression_cnf(node[1], symbol_ids, not positive, budget)
+    children = list(node[1:])
+    if op == '=>':
+        # a => b is ~a || b
+        op, children = '||', [('~', children[0]), children[1]]
+    elif op == '<=>':
+        a, b = children
+        op, children = '&', [('=>', a, b), ('=>', b, a)]
+    # Negation swaps & and || (De Morgan)
+    if (op == '&') == positive:
+        clauses = []
+        for child in children:
+            clauses.extend(expression_cnf(child, symbol_ids, positive, budget))
+    else:
+        clauses = [frozenset()]
+        for child in children:
+            clauses = [clause | other for clause in clauses for other in expression_cnf(child, symbol_ids, positive, budget)]
+            clauses = [clause for clause in set(clauses) if not any(-lit in clause for lit in clause)]
+            if len(clauses) > PREPROCESS_MAX_CLAUSES:
+                raise CNFTooLarge()
+    return clauses
+
+# Simplify a CNF (clauses over positive integer variables) while keeping a reconstruction stack, so a model of the
+# simplified clauses can be extended to one of the original. With exact=True only steps that keep the model count
+# are used: unit propagation, equivalent-literal substitution, subsumption, and eliminating variables that the other
+# variables determine. exact=False (for satisfiability) also removes pure literals and eliminates any variable whose
+# resolvents are no more clauses. Frozen variables are never eliminated. Every pass steps the budget, if one is given
+class Simplifier:
+    def __init__(self, clauses, frozen=(), exact=True, budget=None):
+        self.clauses = set()
+        self.occurs = defaultdict(set)
+        self.frozen = set(frozen)
+        self.exact = exact
+        self.budget = budget
+        self.ok = True
+        # Unit clauses as they are added; propagate_units skips the ones that are gone by then
+        self.units = deque()
+        # Reconstruction steps in order: ('unit', v, value), ('equal', v, lit) or ('eliminate', v, clauses)
+        self.stack = []
+        self.removed = set()
+        for clause in clauses:
+            self.add(clause)
+
+    def add(self, clause):
+        if any(-lit in clause for lit in clause) or clause in self.clauses:
+            return
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self.units.append(clause)
+        self.clauses.add(clause)
+        for lit in clause:
+            self.occurs[lit].add(clause)
+
+    def remove(self, clause):
+        self.clauses.discard(clause)
+        for lit in clause:
+            self.occurs[lit].discard(clause)
+
+    def variables(self):
+        return {abs(lit) for clause in self.clauses for lit in clause}
+
+    def step(self):
+        if self.budget is not None:
+            self.budget.step()
+
+    def assign(self, lit):
+        self.stack.append(('unit', abs(lit), lit > 0))
+        self.removed.add(abs(lit))
+        for clause in list(self.occurs[lit]):
+            self.remove(clause)
+        for clause in list(self.occurs[-lit]):
+            self.remove(clause)
+            self.add(clause - {-lit})
+
+    def propagate_units(self):
+        changed = False
+        while self.ok and self.units:
+            unit = self.units.popleft()
+            if unit not in self.clauses:
+                continue
+            self.step()
+            self.assign(next(iter(unit)))
+            changed = True
+        return changed
+
+    # Binary clauses are implications; literals in one strongly connected component are equivalent
+    def substitute_equivalences(self):
+        graph = nx.DiGraph()
+        for clause in self.clauses:
+            self.step()
+            if len(clause) == 2:
+                a, b = clause
+                graph.add_edge(-a, b)
+                graph.add_edge(-b, a)
+        mapping = {}
+        for component in nx.strongly_connected_components(graph):
+            if len(component) < 2:
+                continue
+            if any(-lit in component for lit in component):
+                self.ok = False
+                return True
+            representative = min(component, key=abs)
+            for lit in component:
+                if abs(lit) != abs(representative) and abs(lit) not in mapping:
+                    mapping[abs(lit)] = representative if lit > 0 else -representative
+        if not mapping:
+            return False
+        for v, lit in mapping.items():
+            self.stack.append(('equal', v, lit))
+            self.removed.add(v)
+        self.frozen |= {abs(mapping[v]) for v in mapping if v in self.frozen}
+        for clause in [clause for clause in self.clauses if any(abs(lit) in mapping for lit in clause)]:
+            self.remove(clause)
+            self.add(frozenset(substitute_literal(lit, mapping) for lit in clause))
+        return True
+
+    def remove_subsumed(self):
+        changed = False
+        for clause in sorted(self.clauses, key=len):
+            if clause not in self.clauses:
+                continue
+            self.step()
+            rarest = min(clause, key=lambda lit: len(self.occurs[lit]))
+            for other in list(self.occurs[rarest]):
+                if other is not clause and other != clause and clause <= other:
+                    self.remove(other)
+                    changed = True
+        return changed
+
+    def remove_pure_literals(self):
+        changed = False
+        for v in sorted(self.variables() - self.frozen):
+            self.step()
+            positive, negative = self.occurs[v], self.occurs[-v]
+            if bool(positive) != bool(negative):
+                clauses = list(positive or negative)
+                self.stack.append(('eliminate', v, clauses))
+                self.removed.add(v)
+                for clause in clauses:
+                    self.remove(clause)
+                changed = True
+        return changed
+
+    # v is determined by the other variables when no assignment of them satisfies the clauses with v both ways
+    def determined(self, v):
+        solver = SATSolver()
+        solver.budget = self.budget
+        variables = {}
+        for clause in self.occurs[v] | self.occurs[-v]:
+            lits = []
+            for lit in clause:
+                if abs(lit) != v:
+                    if abs(lit) not in variables:
+                        variables[abs(lit)] = solver.new_var()
+                    lits.append(variables[abs(lit)] if lit > 0 else -variables[abs(lit)])
+            if not solver.add_clause(lits):
+                return True
+        return not solver.solve()
+
+    def eliminate_variables(self):
+        changed = False
+        for v in sorted(self.variables() - self.frozen):
+            self.step()
+            positive, negative = list(self.occurs[v]), list(self.occurs[-v])
+            if not positive or not negative or len(positive) + len(negative) > BVE_MAX_OCCURRENCES:
+                continue
+            resolvents = {(p - {v}) | (n - {-v}) for p in positive for n in negative}
+            resolvents = [clause for clause in resolvents if not any(-lit in clause for lit in clause)]
+            if len(resolvents) > len(positive) + len(negative) + BVE_GROWTH:
+                continue
+            if self.exact and not self.determined(v):
+                continue
+            self.stack.append(('eliminate', v, positive + negative))
+            self.removed.add(v)
+            for clause in positive + negative:
+                self.remove(clause)
+            for clause in resolvents:
+                self.add(clause)
+            changed = True
+            if not self.ok:
+                break
+        return changed
+
+    def run(self):
+        changed = True
+        while changed and self.ok:
+            changed = self.propagate_units()
+            changed = self.ok and self.substitute_equivalences() or changed
+            changed = self.ok and self.remove_subsumed() or changed
+            if not self.exact:
+                changed = self.ok and self.remove_pure_literals() or changed
+            changed = self.ok and self.eliminate_variables() or changed
+        return self
+
+    # Extend a model of the simplified clauses ({v: bool}) to the removed variables, undoing the steps in reverse
+    def reconstruct(self, model):
+        model = dict(model)
+        for step in reversed(self.stack):
+            kind, v = step[0], step[1]
+            if kind == 'unit':
+                model[v] = step[2]
+            elif kind == 'equal':
+                lit = step[2]
+                model[v] = model.get(abs(lit), False) == (lit > 0)
+            else:
+                model[v] = True
+                if not all(any(model.get(abs(lit), False) == (lit > 0) for lit in clause) for clause in step[2]):
+                    model[v] = False
+        return model
+
+def substitute_literal(lit, mapping):
+    target = mapping.get(abs(lit), abs(lit))
+    return target if lit > 0 else -target
+
+# A KB and query after count-preserving preprocessing, written back as clause strings the engines read: each KB
+# clause as l1 || l2 || ..., the query in disjunctive form as t1 || t2 with t = l1 & l2 (|| splits before &).
+# free counts the symbols that no longer occur and are unconstrained, each doubling the model count
+class Preprocessed:
+    def __init__(self, kb, query, symbols, budget=None):
+        self.symbols = symbols
+        symbol_ids = {symbol: i + 1 for i, symbol in enumerate(symbols)}
+        query_tree = parse_expression(query)
+        clauses = []
+        for clause in kb:
+            clauses.extend(expression_cnf(parse_expression(clause), symbol_ids, budget=budget))
+        query_vars = {symbol_ids[atom] for atom in expression_symbols(query_tree) if atom in symbol_ids}
+        self.simplifier = Simplifier(clauses, frozen=query_vars, budget=budget).run()
+        self.ok = self.simplifier.ok
+        self.name = dict(enumerate(symbols, 1))
+        if self.ok:
+            # Terms of the query's DNF are the negated clauses of ~query's CNF
+            self.terms = self.substitute_terms({frozenset(-lit for lit in clause) for clause in expression_cnf(query_tree, symbol_ids, False)})
+            self.kb = [' || '.join(map(self.literal, sorted(clause, key=abs))) for clause in sorted(self.simplifier.clauses, key=sorted)]
+            self.query = ' || '.join(' & '.join(map(self.literal, sorted(term, key=abs))) for term in sorted(self.terms, key=sorted))
+            remaining = self.simplifier.variables() | {abs(lit) for term in self.terms for lit in term}
+            self.free = len(symbols) - len(remaining | self.simplifier.removed)
+
+    def literal(self, lit):
+        return self.name[lit] if lit > 0 else '~' + self.name[-lit]
+
+    # Rewrite the query's terms through the fixed values and equivalences found in the KB
+    def substitute_terms(self, terms):
+        values, mapping = {}, {}
+        for step in self.simplifier.stack:
+            if step[0] == 'unit':
+                values[step[1]] = step[2]
+            elif step[0] == 'equal':
+                mapping[step[1]] = step[2]
+        substituted = set()
+        for term in terms:
+            lits = set()
+            for lit in term:
+                # Follow equivalences to a literal that is either fixed or still in the simplified KB
+                while abs(lit) in mapping:
+                    lit = substitute_literal(lit, mapping)
+                if abs(lit) in values:
+                    if values[abs(lit)] != (lit > 0):
+                        break
+                else:
+                    lits.add(lit)
+            else:
+                if not any(-lit in lits for lit in lits):
+                    substituted.add(frozenset(lits))
+        # An empty term makes the whole query true, and then its other symbols are unconstrained
+        return {frozenset()} if frozenset() in substituted else substituted
+
+# The symbols TT would enumerate, or None if some of them could not be written back into clause strings
+def preprocess_symbols(kb, query):
+    symbols = sorted(extract_symbols(kb + [query]))
+    return None if '' in symbols else symbols
+
+def preprocess(kb, query, budget=None):
+    symbols = preprocess_symbols(kb, query)
+    if symbols is None:
+        return None
+    try:
+        return Preprocessed(kb, query, symbols, budget)
+    except CNFTooLarge:
+        return None
+
+# Truth table on the preprocessed KB. The simplification keeps model counts, so the count only needs scaling by the
+# symbols it left unconstrained
+def preprocessed_truth_table(kb, query, count, budget):
+    pre = preprocess(kb, query, budget)
+    if pre is None:
+        return truth_table(kb, query, count, budget)
+    #print("Preprocessed KB:", pre.kb, "query:", pre.query, "free symbols:", pre.free) # Debug see what the simplification left
+    if not pre.ok or not pre.terms:
+        return "NO"
+    if frozenset() in pre.terms:
+        # The query holds in every model; any clause of the KB does too and stands in for it
+        if not pre.kb:
+            return f"YES: {2 ** pre.free}"
+        return truth_table(pre.kb, pre.kb[0], count, budget, 2 ** pre.free)
+    return truth_table(pre.kb, pre.query, count, budget, 2 ** pre.free)
+
+def simplified_satisfiable(simplifier, budget):
+    if not simplifier.ok:
+        return False
+    solver = SATSolver()
+    solver.budget = budget
+    variables = defaultdict(solver.new_var)
+    for clause in simplifier.clauses:
+        if not solver.add_clause([variables[lit] if lit > 0 else -variables[-lit] for lit in clause]):
+            return False
+    return solver.solve()
+
+# Entailment by refutation after preprocessing, which then only has to keep satisfiability
+def preprocessed_sat(kb, query, budget):
+    symbols = preprocess_symbols(kb, query)
+    try:
+        try:
+            if symbols is None:
+                raise CNFTooLarge()
+            symbol_ids = {symbol: i + 1 for i, symbol in enumerate(symbols)}
+            clauses = [cnf_clause for clause in kb for cnf_clause in expression_cnf(parse_expression(clause), symbol_ids, budget=budget)]
+            negation = expression_cnf(parse_expression(query), symbol_ids, False, budget)
+        except CNFTooLarge:
+            return SAT(kb, query, budget)
+        # The KB entails the query exactly when the KB has models and none of them falsify the query
+        if simplified_satisfiable(Simplifier(clauses, exact=False, budget=budget).run(), budget) and \
+                not simplified_satisfiable(Simplifier(clauses + negation, exact=False, budget=budget).run(), budget):
+            return "YES"
+        return "NO"
+    except BudgetExceeded as error:
+        return error.result()
+
+# Count up to limit distinct models of the solver's clauses, projected onto the given variables. Blocking clauses
+# are guarded by a fresh activation literal that is retired afterwards, so the solver can be reused.
+# Returns None if the deadline passes before the count is settled. The deadline also holds inside each solve, through
+# the solver's budget, so one hard call cannot run past it; the caller's own limits still raise as usual
+def bounded_count(solver, assumptions, variables, limit, deadline=None):
+    activation = solver.new_var()
+    count = 0
+    budget = solver.budget
+    if deadline is not None:
+        solver.budget = budget or Budget()
+        saved_deadline = solver.budget.deadline
+        solver.budget.deadline = deadline if saved_deadline is None else min(saved_deadline, deadline)
+    try:
+        while count < limit and solver.solve(assumptions + [activation]):
+            if deadline is not None and time.monotonic() > deadline:
+                count = None
+                break
+            count += 1
+            model = solver.model
+            solver.add_clause([-activation] + [-v if model[v] else v for v in variables])
+    except BudgetExceeded as error:
+        if deadline is None or error.reason != "time limit reached" or \
+                (saved_deadline is not None and time.monotonic() > saved_deadline):
+            raise
+        count = None
+    finally:
+        if deadline is not None:
+            solver.budget.deadline = saved_deadline
+            solver.budget = budget
+    solver.add_clause([-activation])
+    solver.simplify()
+    return count
+
+# Add the constraint XOR(variables) == parity, guarded by a fresh activation literal. Returns the activation
+# literal and the auxiliary chain variables, which retire_xor() releases again
+def add_xor(solver, variables, parity):
+    activation = solver.new_var()
+    chain_vars = []
+    if not variables:
+        if parity:
+            solver.add_clause([-activation])
+        return activation, chain_vars
+    chain = variables[0]
+    for v in variables[1:]:
+        t = solver.new_var()
+        chain_vars.append(t)
+        solver.add_clause([-activation, -t, chain, v])
+        solver.add_clause([-activation, -t, -chain, -v])
+        solver.add_clause([-activation, t, -chain, v])
+        solver.add_clause([-activation, t, chain, -v])
+        chain = t
+    solver.add_clause([-activation, chain if parity else -chain])
+    return activation, chain_vars
+
+# Switch an XOR constraint off for good and fix its chain variables, so the solver never branches on them again
+def retire_xor(solver, xor):
+    activation, chain_vars = xor
+    solver.add_clause([-activation])
+    for t in chain_vars:
+        solver.add_clause([-t])
+
+# Hashing-based approximate counting (ApproxMC): random XOR constraints split the models into cells small enough
+# to enumerate, and the median of the scaled cell counts is within a factor (1 + epsilon) of the true count with
+# probability 1 - delta. Returns (estimate, lower, upper, confidence), with the confidence reduced to what the
+# rounds finished before the deadline actually give, or None when no round finished
+def approx_count_hashing(solver, assumptions, variables, epsilon, delta, deadline, rng):
+    threshold = int(1 + 9.84 * (1 + epsilon / (1 + epsilon)) * (1 + 1 / epsilon) ** 2)
+    rounds = math.ceil(17 * math.log2(3 / delta))
+    estimates = []
+    m = 1
+    for _ in range(rounds):
+        if time.monotonic() > deadline:
+            break
+        # Cells only shrink as XORs are added, so search for the fewest XORs that give a small enough cell,
+        # starting from where the last round ended. XORs are only added to the solver once they are needed
+        xors = []
+        cells = {}
+
+        def cell(m):
+            while len(xors) < m:
+                xors.append(add_xor(solver, [v for v in variables if rng.random() < 0.5], rng.random() < 0.5))
+            if m not in cells:
+                cells[m] = bounded_count(solver, assumptions + [xor[0] for xor in xors[:m]], variables, threshold, deadline)
+                if cells[m] is None:
+                    raise TimeoutError
+            return cells[m]
+
+        try:
+            if cell(m) >= threshold:
+                # Gallop up to a small enough cell, then binary search back down to the first one
+                low = m
+                while m < len(variables) and cell(m) >= threshold:
+                    low, m = m, min(2 * m, len(variables))
+                while low + 1 < m:
+                    middle = (low + m) // 2
+                    if cell(middle) >= threshold:
+                        low = middle
+                    else:
+                        m = middle
+            while m > 1 and cell(m - 1) < threshold:
+                m -= 1
+            if cell(m) < threshold:
+                estimates.append(cells[m] * 2 ** m)
+        except TimeoutError:
+            pass
+        for xor in xors:
+            retire_xor(solver, xor)
+        solver.simplify()
+    if not estimates:
+        return None
+    estimate = sorted(estimates)[len(estimates) // 2]
+    confidence = max(0.0, 1 - 3 / 2 ** (len(estimates) / 17))
+    return estimate, math.floor(estimate / (1 + epsilon)), math.ceil(estimate * (1 + epsilon)), confidence
+
+# Importance-sampling approximate counting (Knuth's estimator over the tree of satisfiable partial assignments):
+# each sample fixes the variables one by one in random order, asking the solver which values still extend to a
+# model, picks one of those uniformly and multiplies its weight by how many there were. The mean weight is an
+# unbiased estimate of the count. The weights are heavy-tailed, and a normal-approximation interval undercovers on
+# them, so the interval is Chebyshev's: the mean is within k standard errors of the count with probability at least
+# 1 - 1/k^2 = 1 - delta. Sampling stops once that interval is within epsilon of the estimate, or at the deadline
+def approx_count_sampling(solver, assumptions, variables, epsilon, delta, deadline, rng):
+    z = 1 / math.sqrt(delta)
+    weights = []
+    while time.monotonic() <= deadline:
+        solver.solve(assumptions)
+        model = solver.model
+        prefix = []
+        weight = 1
+        for v in rng.sample(variables, len(variables)):
+            # The current model already shows one value works, so only the other one needs checking
+            lit = v if model[v] else -v
+            if solver.solve(assumptions + prefix + [-lit]):
+                weight *= 2
+                if rng.random() < 0.5:
+                    lit = -lit
+                    model = solver.model
+            prefix.append(lit)
+        weights.append(weight)
+        if len(weights) >= SAMPLING_MIN_SAMPLES:
+            mean = statistics.fmean(weights)
+            if z * statistics.stdev(weights) / math.sqrt(len(weights)) <= epsilon * mean:
+                break
+    if len(weights) < 2:
+        return None
+    mean = statistics.fmean(weights)
+    half_width = z * statistics.stdev(weights) / math.sqrt(len(weights))
+    # There is at least one model (entailment was checked first) and at most 2^n of them
+    lower = max(1, math.floor(mean - half_width))
+    upper = min(2 ** len(variables), math.ceil(mean + half_width))
+    return round(mean), lower, upper, 1 - delta
+
+# The sample deviation of heavy-tailed weights is unreliable at first, so the interval is not trusted before this many samples
+SAMPLING_MIN_SAMPLES = 200
+
+APPROXIMATIONS = {'sampling': approx_count_sampling, 'hashing': approx_count_hashing}
+
+# Approximate Truth Table Method: decides entailment exactly with the SAT solver, then counts the models exactly
+# if there are only a few, and otherwise estimates the count within the time budget using the given approximation
+def ATT(kb, query, epsilon=0.8, delta=0.2, time_budget=60.0, seed=None, approximation='sampling', budget=None):
+    deadline = time.monotonic() + time_budget
+    session = SATSession(kb)
+    answer = session.ask(query, budget)
+    if answer != "YES":
+        return answer
+    rng = random.Random(seed)
+    session.solver.budget = budget
+    try:
+        return approximate_truth_table(session, kb, query, epsilon, delta, deadline, rng, approximation)
+    except BudgetExceeded as error:
+        return error.result(conflicts=session.solver.conflicts)
+
+def approximate_truth_table(session, kb, query, epsilon, delta, deadline, rng, approximation):
+    # The models are counted over the symbols TT enumerates; symbols no clause looks at just double the count
+    symbols = extract_symbols(kb + [query])
+    tree = parse_expression(query)
+    used = sorted((session.kb_atoms | expression_symbols(tree)) & symbols)
+    free = 2 ** (len(symbols) - len(used))
+    variables = [session.literal(('atom', symbol)) for symbol in used]
+    assumptions = session.assumptions(tree, query)
+    solver = session.solver
+
+    exact_limit = int(1 + 9.84 * (1 + epsilon / (1 + epsilon)) * (1 + 1 / epsilon) ** 2)
+    count = bounded_count(solver, assumptions, variables, exact_limit, deadline)
+    if count is not None and count < exact_limit:
+        return f"YES: {count * free}"
+    approximate = APPROXIMATIONS[approximation](solver, assumptions, variables, epsilon, delta, deadline, rng) if count else None
+    if approximate is None:
+        return f"UNKNOWN: no {approximation} estimate finished within the time budget"
+    estimate, lower, upper, confidence = approximate
+    return f"YES: ~{estimate * free} [{lower * free}, {upper * free}] ({confidence:.0%} confidence)"
+
 # Forward Chaining Method
-def FC(kb, query):
+# When a justification dict is passed in, it is filled with symbol -> (rule id, premises) for every inferred symbol
+def FC(kb, query, justification=None, budget=None):
     agenda = []
     inferred = defaultdict(bool)
     count = Counter()
+    rule_ids = {}
 
-    for clause in kb:
+    for rule_id, clause in enumerate(kb):
         if "=>" not in clause:
             agenda.append(clause.strip())
             inferred[clause.strip()] = True
+            if justification is not None:
+                justification.setdefault(clause.strip(), (rule_id, ()))
 
     implications = []
-    for clause in kb:
+    for rule_id, clause in enumerate(kb):
         if "=>" in clause:
             antecedent, consequent = clause.split("=>")
             antecedent = frozenset(map(str.strip, antecedent.strip().split('&')))
             consequent = consequent.strip()
             implications.append((antecedent, consequent))
             count[(antecedent, consequent)] = len(antecedent)
+            rule_ids.setdefault((antecedent, consequent), rule_id)
 
     while agenda:
+        if budget is not None:
+            try:
+                budget.step()
+            except BudgetExceeded as error:
+                return error.result(inferred=sum(inferred.values()), agenda=len(agenda))
         p = agenda.pop(0)
         for antecedent, consequent in implications:
             if p in antecedent:
@@ -124,20 +1892,508 @@ def FC(kb, query):
                     if not inferred[consequent]:
                         inferred[consequent] = True
                         agenda.append(consequent)
-                        
+                        if justification is not None:
+                            justification[consequent] = (rule_ids[(antecedent, consequent)], tuple(sorted(antecedent)))
+
     # After agenda is empty, we check if the query was inferred
     if inferred[query]:
         return f"YES: {', '.join(sorted(k for k, v in inferred.items() if v))}"
     return "NO"
 
+# One worker of the parallel FC: owns a partition of the rules and their premise counters in shared memory.
+# Each round it receives the newly inferred symbols (the delta) and sends back the consequents whose counters ran out
+def fc_partition_worker(conn, inferred_name, counters_name, index):
+    worker_signals()
+    inferred_shm = shared_memory.SharedMemory(name=inferred_name)
+    counters_shm = shared_memory.SharedMemory(name=counters_name)
+    inferred = inferred_shm.buf
+    counters = counters_shm.buf.cast('i')
+    try:
+        while True:
+            delta = conn.recv()
+            if delta is None:
+                break
+            conn.send(fc_round(delta, index, inferred, counters))
+    finally:
+        counters.release()
+        inferred.release()
+        inferred_shm.close()
+        counters_shm.close()
+
+# Match one delta against a rule index, returning the consequents whose premise counters reached zero this round
+def fc_round(delta, index, inferred, counters):
+    fired = []
+    for symbol, multiplicity in delta:
+        for key, weight, consequent in index.get(symbol, ()):
+            before = counters[key]
+            counters[key] = before - weight * multiplicity
+            if before > 0 and counters[key] <= 0 and not inferred[consequent]:
+                fired.append(consequent)
+    return fired
+
+# Intern a KB for the semi-naive forward chainers. Returns the sorted symbol table, the fact symbol ids with the number
+# of times each is told, the rule keys (premises, consequent) and an index from premise symbol id to
+# (rule key id, weight, consequent symbol id). FC puts a fact on the agenda once per occurrence, and rules with the
+# same premises and conclusion share one counter, so a key is decremented once per rule that has it (its weight)
+def compile_horn(kb):
+    facts = [clause.strip() for clause in kb if "=>" not in clause]
+    entries = Counter()
+    for clause in kb:
+        if "=>" in clause:
+            antecedent, consequent = clause.split("=>")
+            entries[(frozenset(map(str.strip, antecedent.strip().split('&'))), consequent.strip())] += 1
+    keys = list(entries)
+
+    symbols = sorted(set(facts) | {symbol for antecedent, consequent in keys for symbol in antecedent | {consequent}})
+    symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+    index = defaultdict(list)
+    for key_id, (antecedent, consequent) in enumerate(keys):
+        for premise in antecedent:
+            index[symbol_ids[premise]].append((key_id, entries[keys[key_id]], symbol_ids[consequent]))
+    return symbols, Counter(symbol_ids[fact] for fact in facts), keys, index
+
+# Rounds with fewer new symbols than this are matched in the main process
+PFC_MIN_DELTA = 2048
+
+# Semi-naive, level-synchronous Forward Chaining: every round matches only the newly inferred symbols against the
+# rules, split over worker processes that share the inferred flags and premise counters, and merges at the barrier.
+# FC's counters only ever go down, so the closure (and the answer) does not depend on the order of the agenda
+def PFC(kb, query, workers=None, budget=None):
+    symbols, facts, keys, index = compile_horn(kb)
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(keys)))
+    indexes = [defaultdict(list) for _ in range(workers)]
+    for symbol, matches in index.items():
+        for match in matches:
+            indexes[match[0] % workers][symbol].append(match)
+
+    inferred_shm = shared_memory.SharedMemory(create=True, size=max(len(symbols), 1))
+    counters_shm = shared_memory.SharedMemory(create=True, size=max(4 * len(keys), 4))
+    inferred = inferred_shm.buf
+    counters = counters_shm.buf.cast('i')
+    processes = []
+    try:
+        for key_id, (antecedent, _) in enumerate(keys):
+            counters[key_id] = len(antecedent)
+        for symbol in facts:
+            inferred[symbol] = 1
+
+        connections = []
+        if workers > 1:
+            for index in indexes:
+                parent_conn, child_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=fc_partition_worker, args=(child_conn, inferred_shm.name, counters_shm.name, dict(index)), daemon=True)
+                process.start()
+                processes.append(process)
+                connections.append(parent_conn)
+
+        delta = sorted(facts.items())
+        while delta:
+            if budget is not None:
+                try:
+                    budget.step(len(delta))
+                except BudgetExceeded as error:
+                    return error.result(inferred=sum(1 for flag in inferred if flag), delta=len(delta))
+            # Small deltas are not worth a round trip to the workers; they are idle at the barrier, so the
+            # main process can update every partition's counters itself
+            if connections and len(delta) >= PFC_MIN_DELTA:
+                for conn in connections:
+                    conn.send(delta)
+                fired = [symbol for conn in connections for symbol in conn.recv()]
+            else:
+                fired = [symbol for index in indexes for symbol in fc_round(delta, index, inferred, counters)]
+            # Round barrier: every partition has finished, so the new facts can be published for the next round
+            delta = []
+            for symbol in sorted(set(fired)):
+                if not inferred[symbol]:
+                    inferred[symbol] = 1
+                    delta.append((symbol, 1))
+
+        for conn in connections:
+            conn.send(None)
+        for process in processes:
+            process.join()
+        closure = sorted(symbol for symbol_id, symbol in enumerate(symbols) if inferred[symbol_id])
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        counters.release()
+        inferred.release()
+        inferred_shm.close()
+        inferred_shm.unlink()
+        counters_shm.close()
+        counters_shm.unlink()
+
+    if query in closure:
+        return f"YES: {', '.join(closure)}"
+    return "NO"
+
+# Forward chaining as a generator of the closure in derivation order: the facts as they are told, then each consequent
+# as soon as its rule fires. Same closure as FC (repeated facts and rules count the same way), but nothing is collected,
+# so the caller can write symbols out as they come. A BudgetExceeded from the budget is raised to the caller
+def fc_closure(kb, budget=None):
+    symbols, facts, keys, index = compile_horn(kb)
+    symbol_ids = {symbol: i for i, symbol in enumerate(symbols)}
+    inferred = bytearray(len(symbols))
+    counters = array.array('i', (len(antecedent) for antecedent, _ in keys))
+    agenda = deque()
+    for clause in kb:
+        if "=>" not in clause:
+            symbol = symbol_ids[clause.strip()]
+            if not inferred[symbol]:
+                inferred[symbol] = 1
+                agenda.append((symbol, facts[symbol]))
+                yield symbols[symbol]
+    while agenda:
+        if budget is not None:
+            budget.step()
+        for consequent in fc_round((agenda.popleft(),), index, inferred, counters):
+            if not inferred[consequent]:
+                inferred[consequent] = 1
+                agenda.append((consequent, 1))
+                yield symbols[consequent]
+
+# Symbols per sorted run of the streaming writer
+STREAM_RUN = 1 << 16
+
+# External sort for the streaming writer: symbols are sorted in runs of STREAM_RUN, every full run is spilled to a
+# temporary file, and merged() reads the runs back in one pass, so only one run is ever held in memory
+class SortedRuns:
+    def __init__(self, run=STREAM_RUN):
+        self.run = run
+        self.chunk = []
+        self.spills = []
+
+    def add(self, symbol):
+        self.chunk.append(symbol)
+        if len(self.chunk) >= self.run:
+            spill = tempfile.TemporaryFile('w+', encoding='utf-8')
+            spill.writelines(symbol + '\n' for symbol in sorted(self.chunk))
+            spill.seek(0)
+            self.spills.append(spill)
+            self.chunk = []
+
+    def merged(self):
+        self.chunk.sort()
+        return heapq.merge(*[(line[:-1] for line in spill) for spill in self.spills], self.chunk)
+
+    def close(self):
+        for spill in self.spills:
+            spill.close()
+        self.spills = []
+
+# Streaming FC output, for closures too large to sort and join in memory. order is 'derivation' (one symbol per line
+# as it is inferred, then a YES/NO line with the closure size) or 'sorted' (FC's own "YES: a, b, ..." line, written
+# from the sorted runs). result 'count' prints only the answer and the closure size, 'query' only the answer, and
+# stops as soon as the query is inferred. Returns the answer, or the UNKNOWN result if the budget runs out
+def stream_fc(kb, query, output=sys.stdout, order='derivation', result='closure', budget=None):
+    runs = SortedRuns() if order == 'sorted' and result == 'closure' else None
+    count = 0
+    found = False
+    try:
+        for symbol in fc_closure(kb, budget):
+            count += 1
+            found = found or symbol == query
+            if result == 'query' and found:
+                break
+            if runs is not None:
+                runs.add(symbol)
+            elif result == 'closure':
+                output.write(symbol + '\n')
+        answer = "YES" if found else "NO"
+        if result == 'query':
+            print(answer, file=output)
+        elif runs is not None and found:
+            output.write("YES: ")
+            for i, symbol in enumerate(runs.merged()):
+                output.write(", " + symbol if i else symbol)
+            output.write("\n")
+        elif runs is not None:
+            print(answer, file=output)
+        else:
+            print(f"{answer}: {count}", file=output)
+    except BudgetExceeded as error:
+        answer = error.result(inferred=count)
+        print(answer, file=output)
+    finally:
+        if runs is not None:
+            runs.close()
+    output.flush()
+    return answer
+
+# Forward closure kept in memory-mapped files, so that several processes can read one saved closure without copying
+# it and a restarted process can reattach instead of recomputing. The directory holds the sorted symbol table
+# (symbols.bin with offsets.bin, looked up by binary search), one inferred flag per symbol (inferred.bin), the rule
+# premise counters (counters.bin) and the premise index in CSR form (index_offsets.bin, index.bin).
+# Each build writes its files into a fresh build-* subdirectory and derives the closure there; only then is meta.json,
+# which records the KB hash and names the build, swapped in with os.replace. A build that stops early is never
+# visible, and readers attached to an older build keep valid files until they close them
+class MappedFactStore:
+    FILES = ('symbols.bin', 'offsets.bin', 'inferred.bin', 'counters.bin', 'index_offsets.bin', 'index.bin')
+
+    def __init__(self, directory, writable=False, meta=None):
+        self.directory = directory
+        if meta is None:
+            with open(os.path.join(directory, 'meta.json')) as file:
+                meta = json.load(file)
+        self.meta = meta
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.maps = {}
+        for name in self.FILES:
+            with open(os.path.join(directory, meta['build'], name), 'r+b' if writable else 'rb') as file:
+                self.maps[name] = mmap.mmap(file.fileno(), 0, access=access)
+        self.symbols = self.maps['symbols.bin']
+        self.offsets = memoryview(self.maps['offsets.bin']).cast('q')
+        self.inferred = self.maps['inferred.bin']
+        self.counters = memoryview(self.maps['counters.bin']).cast('i')
+        self.index_offsets = memoryview(self.maps['index_offsets.bin']).cast('q')
+        self.index_entries = memoryview(self.maps['index.bin']).cast('i')
+        self.size = self.meta['symbols']
+
+    @staticmethod
+    def kb_hash(kb):
+        return hashlib.sha256('\n'.join(kb).encode()).hexdigest()
+
+    # Reattach to the store in directory if it was built from this KB, otherwise (re)build it
+    @classmethod
+    def load(cls, directory, kb, budget=None):
+        try:
+            store = cls(directory)
+            if store.meta['kb_hash'] == cls.kb_hash(kb):
+                return store
+            store.close()
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.build(directory, kb, budget)
+
+    @classmethod
+    def build(cls, directory, kb, budget=None):
+        symbols, facts, keys, index = compile_horn(kb)
+        build = f"build-{secrets.token_hex(8)}"
+        os.makedirs(os.path.join(directory, build))
+
+        encoded = [symbol.encode() for symbol in symbols]
+        offsets = array.array('q', [0])
+        for symbol in encoded:
+            offsets.append(offsets[-1] + len(symbol))
+        index_offsets = array.array('q', [0])
+        entries = array.array('i')
+        for symbol_id in range(len(symbols)):
+            for match in index.get(symbol_id, ()):
+                entries.extend(match)
+            index_offsets.append(len(entries) // 3)
+        counters = array.array('i', [len(antecedent) for antecedent, _ in keys])
+        contents = {
+            'symbols.bin': b''.join(encoded),
+            'offsets.bin': offsets.tobytes(),
+            'inferred.bin': bytes(len(symbols)),
+            'counters.bin': counters.tobytes(),
+            'index_offsets.bin': index_offsets.tobytes(),
+            'index.bin': entries.tobytes(),
+        }
+        meta = {'kb_hash': cls.kb_hash(kb), 'symbols': len(symbols), 'keys': len(keys), 'build': build}
+        try:
+            for name, data in contents.items():
+                # mmap cannot map an empty file
+                with open(os.path.join(directory, build, name), 'wb') as file:
+                    file.write(data or bytes(8))
+            store = cls(directory, writable=True, meta=meta)
+            try:
+                store.derive(facts, budget)
+                store.flush()
+            finally:
+                store.close()
+        except BaseException:
+            shutil.rmtree(os.path.join(directory, build), ignore_errors=True)
+            raise
+
+        # Commit: the new meta.json names the finished build, then older builds are unlinked (a reader that still maps
+        # their files keeps them until it closes)
+        with open(os.path.join(directory, 'meta.json.tmp'), 'w') as file:
+            json.dump(meta, file)
+        os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+        for name in os.listdir(directory):
+            if name.startswith('build-') and name != build:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+            elif name in cls.FILES:
+                os.remove(os.path.join(directory, name))
+        return cls(directory)
+
+    # Semi-naive FC rounds straight on the mapped flags and counters; facts maps symbol ids to how often they are told
+    def derive(self, facts, budget=None):
+        delta = []
+        for symbol, multiplicity in sorted(facts.items()):
+            if not self.inferred[symbol]:
+                self.inferred[symbol] = 1
+            delta.append((symbol, multiplicity))
+        while delta:
+            if budget is not None:
+                budget.step(len(delta))
+            fired = fc_round(delta, self, self.inferred, self.counters)
+            delta = []
+            for symbol in sorted(set(fired)):
+                if not self.inferred[symbol]:
+                    self.inferred[symbol] = 1
+                    delta.append((symbol, 1))
+
+    # Index lookup in the shape fc_round expects: the (rule key id, weight, consequent) entries for one premise
+    def get(self, symbol, default=()):
+        start, end = self.index_offsets[symbol], self.index_offsets[symbol + 1]
+        entries = self.index_entries[3 * start:3 * end]
+        return [tuple(entries[i:i + 3]) for i in range(0, len(entries), 3)] if entries else default
+
+    def symbol(self, symbol_id):
+        return self.symbols[self.offsets[symbol_id]:self.offsets[symbol_id + 1]].decode()
+
+    def lookup(self, symbol):
+        encoded = symbol.encode()
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.symbols[self.offsets[middle]:self.offsets[middle + 1]] < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.size and self.symbols[self.offsets[low]:self.offsets[low + 1]] == encoded:
+            return low
+        return None
+
+    def is_inferred(self, symbol):
+        symbol_id = self.lookup(symbol)
+        return symbol_id is not None and bool(self.inferred[symbol_id])
+
+    def ask(self, query):
+        if self.is_inferred(query):
+            return f"YES: {', '.join(self.symbol(i) for i in range(self.size) if self.inferred[i])}"
+        return "NO"
+
+    def flush(self):
+        for mapped in self.maps.values():
+            mapped.flush()
+
+    def close(self):
+        for view in (self.offsets, self.counters, self.index_offsets, self.index_entries):
+            view.release()
+        for mapped in self.maps.values():
+            mapped.close()
+
+# Forward closure with truth maintenance: facts and rules can be told and retracted without recomputing everything.
+# Every rule keeps a counter of premises not yet inferred. Retracting over-deletes everything that could depend on
+# the removed support, then re-derives the over-deleted symbols that still have another derivation (DRed).
+# Unlike FC (and PFC, MappedFactStore, TenantKB and fc_closure, which copy it), this is the sound closure: a symbol is
+# inferred only when every premise of one of its rules is. FC's counters also drop once per repeated fact or rule, so
+# with repeats FC can fire a rule early (p2; p2; p2 & p3 => p4 gives p4), which has no consistent retraction. On KBs
+# without repeated facts or rules the two agree
+class ForwardTMS:
+    def __init__(self, kb=()):
+        self.asserted = Counter()
+        self.rules = []
+        self.count = []
+        self.rules_by_premise = defaultdict(set)
+        self.rules_by_consequent = defaultdict(set)
+        self.inferred = set()
+        for clause in kb:
+            self.tell(clause)
+
+    # Split a clause the way FC does: a rule (premises, consequent) or a fact
+    @staticmethod
+    def parse(clause):
+        if "=>" in clause:
+            antecedent, consequent = clause.split("=>")
+            return frozenset(map(str.strip, antecedent.strip().split('&'))), consequent.strip()
+        return None, clause.strip()
+
+    def tell(self, clause):
+        premises, consequent = self.parse(clause)
+        if premises is None:
+            self.asserted[consequent] += 1
+            self.derive([consequent])
+            return
+        rule_id = len(self.rules)
+        self.rules.append((premises, consequent))
+        self.count.append(len(premises - self.inferred))
+        for premise in premises:
+            self.rules_by_premise[premise].add(rule_id)
+        self.rules_by_consequent[consequent].add(rule_id)
+        if self.count[rule_id] == 0:
+            self.derive([consequent])
+
+    def retract(self, clause):
+        premises, consequent = self.parse(clause)
+        if premises is None:
+            if self.asserted[consequent] == 0:
+                raise ValueError(f"{clause!r} is not in the KB")
+            self.asserted[consequent] -= 1
+            if self.asserted[consequent] == 0:
+                del self.asserted[consequent]
+                self.rederive(self.overdelete(consequent))
+            return
+        for rule_id in self.rules_by_consequent[consequent]:
+            if self.rules[rule_id] == (premises, consequent):
+                break
+        else:
+            raise ValueError(f"{clause!r} is not in the KB")
+        self.rules[rule_id] = None
+        for premise in premises:
+            self.rules_by_premise[premise].discard(rule_id)
+        self.rules_by_consequent[consequent].discard(rule_id)
+        self.rederive(self.overdelete(consequent))
+
+    # Agenda loop of FC, starting from the given symbols and keeping the premise counters up to date
+    def derive(self, agenda):
+        agenda = [symbol for symbol in agenda if symbol not in self.inferred]
+        self.inferred.update(agenda)
+        while agenda:
+            p = agenda.pop()
+            for rule_id in self.rules_by_premise[p]:
+                self.count[rule_id] -= 1
+                consequent = self.rules[rule_id][1]
+                if self.count[rule_id] == 0 and consequent not in self.inferred:
+                    self.inferred.add(consequent)
+                    agenda.append(consequent)
+
+    # Remove the symbol and everything derived through it, whether or not it has other support
+    def overdelete(self, symbol):
+        if symbol not in self.inferred:
+            return set()
+        deleted = {symbol}
+        agenda = [symbol]
+        while agenda:
+            p = agenda.pop()
+            self.inferred.discard(p)
+            for rule_id in self.rules_by_premise[p]:
+                self.count[rule_id] += 1
+                consequent = self.rules[rule_id][1]
+                if consequent in self.inferred and consequent not in deleted:
+                    deleted.add(consequent)
+                    agenda.append(consequent)
+        return deleted
+
+    # Put back the over-deleted symbols that are still asserted or still have a rule with every premise inferred
+    def rederive(self, deleted):
+        supported = [symbol for symbol in deleted
+                     if self.asserted[symbol] or any(self.count[rule_id] == 0 for rule_id in self.rules_by_consequent[symbol])]
+        self.derive(supported)
+
+    def ask(self, query):
+        if query in self.inferred:
+            return f"YES: {', '.join(sorted(self.inferred))}"
+        return "NO"
+
 # Backward Chaining Method
-def BC(kb, query):
+def BC(kb, query, budget=None):
     # Initialize inferred symbols and relevant symbols
     agenda = [query]
     inferred = defaultdict(bool)
     relevant = set()
 
     while agenda:
+        if budget is not None:
+            try:
+                budget.step()
+            except BudgetExceeded as error:
+                return error.result(relevant=len(relevant), agenda=len(agenda))
         q = agenda.pop(0)
         #print(f"Processing query: {q}") #Debug uncomment to see the query being processed
         if not inferred[q]:
@@ -172,26 +2428,959 @@ def BC(kb, query):
         return f"YES: {', '.join(sorted(relevant))}"
     return "NO"
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python redo_3.py <filename> <search_method>")
+# Tabled Backward Chaining shared across queries. A goal's answer (what BC reports as relevant) is everything reachable
+# from it through rules concluding it, so goals are tabled per strongly connected component of that rule graph:
+# each completed component records its members and the components it depends on, and later queries reuse them.
+# Telling or retracting a rule only drops the components that can reach its consequent
+class BCTable:
+    def __init__(self, kb=()):
+        self.rules = defaultdict(list)
+        self.scc_of = {}
+        self.scc_members = []
+        self.scc_deps = []
+        self.scc_parents = []
+        self.answers = {}
+        for clause in kb:
+            self.tell(clause)
+
+    # Split a rule the way BC does, returning (consequent, premise symbols), or None for a fact (BC ignores facts)
+    @staticmethod
+    def parse(clause):
+        if "=>" not in clause:
+            return None
+        antecedent, consequent = clause.split("=>")
+        return consequent.strip(), [s.strip() for s in re.split('&|\\|\\|', antecedent.strip())]
+
+    def tell(self, clause):
+        rule = self.parse(clause)
+        if rule is not None:
+            self.rules[rule[0]].append(rule[1])
+            self.invalidate(rule[0])
+
+    def retract(self, clause):
+        rule = self.parse(clause)
+        if rule is not None:
+            self.rules[rule[0]].remove(rule[1])
+            self.invalidate(rule[0])
+
+    # Drop the tabled component of a goal whose rules changed, and every component that depends on it
+    def invalidate(self, goal):
+        if goal not in self.scc_of:
+            return
+        agenda = [self.scc_of[goal]]
+        while agenda:
+            scc = agenda.pop()
+            if self.scc_members[scc] is None:
+                continue
+            for member in self.scc_members[scc]:
+                del self.scc_of[member]
+            self.scc_members[scc] = None
+            self.answers.pop(scc, None)
+            agenda.extend(self.scc_parents[scc])
+            for dep in self.scc_deps[scc]:
+                self.scc_parents[dep].discard(scc)
+
+    def subgoals(self, goal):
+        return list(dict.fromkeys(symbol for premises in self.rules.get(goal, ()) for symbol in premises))
+
+    # Tarjan's algorithm from the goal, treating goals that are already tabled as completed leaves
+    def complete(self, goal, budget=None):
+        index, low = {}, {}
+        stack, on_stack = [], set()
+        work = [(goal, iter(self.subgoals(goal)))]
+        index[goal] = low[goal] = 0
+        stack.append(goal)
+        on_stack.add(goal)
+        while work:
+            if budget is not None:
+                budget.step()
+            node, successors = work[-1]
+            for successor in successors:
+                if successor in self.scc_of:
+                    continue
+                if successor not in index:
+                    index[successor] = low[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append((successor, iter(self.subgoals(successor))))
+                    break
+                if successor in on_stack:
+                    low[node] = min(low[node], index[successor])
+            else:
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == node:
+                            break
+                    scc = len(self.scc_members)
+                    for member in members:
+                        self.scc_of[member] = scc
+                    deps = {self.scc_of[s] for member in members for s in self.subgoals(member)} - {scc}
+                    self.scc_members.append(members)
+                    self.scc_deps.append(deps)
+                    self.scc_parents.append(set())
+                    for dep in deps:
+                        self.scc_parents[dep].add(scc)
+
+    def relevant(self, goal, budget=None):
+        if goal not in self.scc_of:
+            self.complete(goal, budget)
+        scc = self.scc_of[goal]
+        if scc not in self.answers:
+            relevant, seen, agenda = set(), {scc}, [scc]
+            while agenda:
+                current = agenda.pop()
+                relevant.update(self.scc_members[current])
+                for dep in self.scc_deps[current]:
+                    if dep not in seen:
+                        seen.add(dep)
+                        agenda.append(dep)
+            self.answers[scc] = sorted(relevant)
+        return self.answers[scc]
+
+    # Components completed before the budget ran out stay tabled; the unfinished search is simply dropped
+    def ask(self, query, budget=None):
+        try:
+            return f"YES: {', '.join(self.relevant(query, budget))}"
+        except BudgetExceeded as error:
+            return error.result(tabled=len(self.scc_of))
+
+# Goal-directed backward chaining that proves the query from the facts through the rules (read the way FC reads
+# them), trying the cheapest way first. Alternative rules and their premises are ordered by statistics from earlier
+# queries: known facts and proven goals first, rules with a premise that is known to fail skipped, then premises
+# that fail often (so a doomed rule is given up early) and subgoals that were cheap to settle before expensive ones.
+# Goals proven or refuted are cached for later queries; a failure is only cached when it did not depend on a goal
+# further up the current path. The statistics are kept in stats_file between runs
+class GoalPlanner:
+    def __init__(self, kb, stats_file=None):
+        self.facts = set()
+        self.rules = defaultdict(list)
+        for clause in kb:
+            if "=>" not in clause:
+                self.facts.add(clause.strip())
+            else:
+                antecedent, consequent = clause.split("=>")
+                self.rules[consequent.strip()].append(sorted(set(map(str.strip, antecedent.strip().split('&')))))
+        self.proven = {fact: () for fact in self.facts}
+        self.failed = set()
+        self.stats_file = stats_file
+        # goal -> [times tried, times failed, nodes expanded in total]
+        self.stats = defaultdict(lambda: [0, 0, 0])
+        if stats_file is not None and os.path.exists(stats_file):
+            try:
+                with open(stats_file) as file:
+                    self.stats.update(json.load(file))
+            except (OSError, ValueError):
+                pass
+
+    # The statistics only speed up later runs, so a file that cannot be written is reported and skipped
+    def save(self):
+        if self.stats_file is not None:
+            try:
+                with open(self.stats_file + '.tmp', 'w') as file:
+                    json.dump(self.stats, file)
+                os.replace(self.stats_file + '.tmp', self.stats_file)
+            except OSError as error:
+                print(f"Warning: could not save the BCP statistics to {self.stats_file}: {error.strerror}", file=sys.stderr)
+
+    def cost(self, goal):
+        if goal in self.proven:
+            return 0
+        tried, _, nodes = self.stats.get(goal, (0, 0, 0))
+        return nodes / tried if tried else 1
+
+    def failure_rate(self, goal):
+        tried, failed, _ = self.stats.get(goal, (0, 0, 0))
+        return failed / tried if tried else 0
+
+    # The goal's rules as premise lists in the order to try them, leaving out rules that cannot succeed
+    def plan(self, goal):
+        rules = []
+        for premises in self.rules.get(goal, ()):
+            if any(premise in self.failed for premise in premises):
+                continue
+            premises = sorted(premises, key=lambda premise: (premise not in self.proven, -self.failure_rate(premise), self.cost(premise)))
+            rules.append((sum(map(self.cost, premises)), premises))
+        return [premises for _, premises in sorted(rules, key=lambda rule: rule[0])]
+
+    # Depth-first proof search with an explicit stack of [goal, rules, rule, premise, lowest ancestor depth reached,
+    # nodes expanded on entry]
+    def prove(self, query, budget=None):
+        if query in self.proven or query in self.failed:
+            return query in self.proven
+        depth_of = {query: 0}
+        frames = [[query, self.plan(query), 0, 0, 0, 0]]
+        nodes = 0
+        result = None
+        while frames:
+            if budget is not None:
+                budget.step()
+            frame = frames[-1]
+            goal, rules, rule, premise = frame[:4]
+            if rule < len(rules) and premise == len(rules[rule]):
+                result = True
+                self.proven[goal] = tuple(rules[rule])
+            elif rule == len(rules):
+                result = False
+                # Without a loop back to an ancestor the goal fails whatever the path to it
+                if frame[4] >= len(frames) - 1:
+                    self.failed.add(goal)
+            else:
+                subgoal = rules[rule][premise]
+                if subgoal in self.proven:
+                    frame[3] += 1
+                elif subgoal in self.failed:
+                    frame[2], frame[3] = rule + 1, 0
+                elif subgoal in depth_of:
+                    frame[4] = min(frame[4], depth_of[subgoal])
+                    frame[2], frame[3] = rule + 1, 0
+                else:
+                    nodes += 1
+                    depth_of[subgoal] = len(frames)
+                    frames.append([subgoal, self.plan(subgoal), 0, 0, len(frames), nodes])
+                continue
+
+            frames.pop()
+            del depth_of[goal]
+            stats = self.stats[goal]
+            stats[0] += 1
+            stats[1] += not result
+            stats[2] += nodes - frame[5] + 1
+            if frames:
+                parent = frames[-1]
+                parent[4] = min(parent[4], frame[4])
+                if result:
+                    parent[3] += 1
+                else:
+                    parent[2], parent[3] = parent[2] + 1, 0
+        return result
+
+    def ask(self, query, budget=None):
+        try:
+            if not self.prove(query, budget):
+                return "NO"
+        except BudgetExceeded as error:
+            return error.result(proven=len(self.proven), failed=len(self.failed))
+        # The symbols of the proof that was found, from the query down to the facts
+        proof, agenda = {query}, [query]
+        while agenda:
+            for premise in self.proven[agenda.pop()]:
+                if premise not in proof:
+                    proof.add(premise)
+                    agenda.append(premise)
+        return f"YES: {', '.join(sorted(proof))}"
+
+# Clause strings, symbols and compiled rules shared by every KB in the process, so a clause that many KBs contain is
+# stored once. A clause compiles to its FC form (a fact, or a (premises, consequent) key as FC builds it) and its BC
+# form (consequent and the premises BC splits off with & and ||); either is None if the clause is not of that shape
+class RulePool:
+    def __init__(self):
+        self.compiled = {}
+
+    def intern(self, clause):
+        if clause not in self.compiled:
+            clause = sys.intern(clause)
+            fact = key = goal = None
+            if "=>" not in clause:
+                fact = sys.intern(clause.strip())
+            elif clause.count("=>") == 1:
+                antecedent, consequent = clause.split("=>")
+                consequent = sys.intern(consequent.strip())
+                key = (frozenset(sys.intern(premise.strip()) for premise in antecedent.strip().split('&')), consequent)
+                goal = (consequent, tuple(sys.intern(premise.strip()) for premise in re.split('&|\\|\\|', antecedent.strip())))
+            self.compiled[clause] = (clause, fact, key, goal)
+        return self.compiled[clause]
+
+# The FC and BC indexes of a group of clauses: fact -> times told, rule key -> number of rules with it (FC shares one
+# counter between them), premise -> rule keys it appears in, and consequent -> BC premise lists. Index values are
+# tuples, so a layer over these maps can change an entry without touching the one underneath
+def add_to_indexes(compiled, facts, weights, premises, goals):
+    clause, fact, key, goal = compiled
+    if fact is not None:
+        facts[fact] = facts.get(fact, 0) + 1
+    if key is not None:
+        if key not in weights:
+            for premise in key[0]:
+                premises[premise] = premises.get(premise, ()) + (key,)
+        weights[key] = weights.get(key, 0) + 1
+    if goal is not None:
+        goals[goal[0]] = goals.get(goal[0], ()) + (goal[1],)
+
+# A base rule library: its clauses and indexes, built once and never changed after
+class RuleLibrary:
+    def __init__(self, pool, clauses):
+        self.pool = pool
+        self.compiled = tuple(pool.intern(clause) for clause in clauses)
+        self.facts, self.weights, self.premises, self.goals = {}, {}, {}, {}
+        # Clauses that are neither facts nor single rules make FC and BC fail, as they do on the plain KB
+        self.horn = all(fact is not None or key is not None for _, fact, key, _ in self.compiled)
+        for compiled in self.compiled:
+            add_to_indexes(compiled, self.facts, self.weights, self.premises, self.goals)
+
+    @classmethod
+    def load(cls, pool, filename):
+        return cls(pool, load_kb(filename)[0])
+
+# One tenant's KB: a shared base library plus the tenant's own facts and rules. The tenant's indexes are layers over
+# the library's (ChainMap reads the tenant's entry first and writes only to it), so telling a clause copies just the
+# index entries it changes and the rest stays shared. FC and BC answer exactly as on the concatenated clause list
+class TenantKB:
+    def __init__(self, library, clauses=()):
+        self.library = library
+        self.delta = []
+        self.facts = ChainMap({}, library.facts)
+        self.weights = ChainMap({}, library.weights)
+        self.premises = ChainMap({}, library.premises)
+        self.goals = ChainMap({}, library.goals)
+        self.horn = library.horn
+        for clause in clauses:
+            self.tell(clause)
+
+    def tell(self, clause):
+        compiled = self.library.pool.intern(clause)
+        self.delta.append(compiled)
+        self.horn = self.horn and (compiled[1] is not None or compiled[2] is not None)
+        add_to_indexes(compiled, self.facts, self.weights, self.premises, self.goals)
+
+    def clauses(self):
+        return [compiled[0] for compiled in self.library.compiled + tuple(self.delta)]
+
+    # Semi-naive FC over the layered indexes, as in PFC: a fact decrements its rules' counters once per time it is
+    # told, and each rule key is decremented once per rule that has it
+    def forward_chain(self, query, budget=None):
+        if not self.horn:
+            return FC(self.clauses(), query, budget=budget)
+        counters = {key: len(key[0]) for key in self.weights}
+        inferred = set(self.facts)
+        delta = sorted(self.facts.items())
+        try:
+            while delta:
+                if budget is not None:
+                    budget.step(len(delta))
+                fired = []
+                for symbol, multiplicity in delta:
+                    for key in self.premises.get(symbol, ()):
+                        before = counters[key]
+                        counters[key] = before - self.weights[key] * multiplicity
+                        if before > 0 and counters[key] <= 0 and key[1] not in inferred:
+                            fired.append(key[1])
+                delta = [(symbol, 1) for symbol in sorted(set(fired))]
+                inferred.update(fired)
+        except BudgetExceeded as error:
+            return error.result(inferred=len(inferred))
+        if query in inferred:
+            return f"YES: {', '.join(sorted(inferred))}"
+        return "NO"
+
+    # BC's answer is every goal reachable from the query through the rules that conclude it
+    def backward_chain(self, query, budget=None):
+        if not self.horn:
+            return BC(self.clauses(), query, budget=budget)
+        relevant = {query}
+        agenda = [query]
+        try:
+            while agenda:
+                if budget is not None:
+                    budget.step()
+                for premises in self.goals.get(agenda.pop(), ()):
+                    for premise in premises:
+                        if premise not in relevant:
+                            relevant.add(premise)
+                            agenda.append(premise)
+        except BudgetExceeded as error:
+            return error.result(relevant=len(relevant), agenda=len(agenda))
+        return f"YES: {', '.join(sorted(relevant))}"
+
+# Engines the portfolio can race, with the method whose answer format their YES is in. BC is left out: it answers
+# YES with the goals it reached whatever the KB, so it does not decide entailment, and PFC would need processes of
+# its own inside a portfolio worker
+PORTFOLIO_ENGINES = {'TT': 'TT', 'TTC': 'TT', 'TTP': 'TT', 'TTPRE': 'TT', 'SAT': 'SAT', 'SATPRE': 'SAT', 'FC': 'FC'}
+
+# Where per-KB win counts are kept between runs
+PORTFOLIO_STATS = os.path.join(os.path.expanduser('~'), '.iengine_portfolio.json')
+
+def portfolio_engine(name, kb, query, budget):
+    if name == 'TT':
+        return TT(kb, query, budget=budget)
+    elif name == 'TTC':
+        return TT(kb, query, enumeration='compiled', budget=budget)
+    elif name == 'TTP':
+        return TT(kb, query, enumeration='pruned', budget=budget)
+    elif name == 'TTPRE':
+        return TT(kb, query, budget=budget, preprocess=True)
+    elif name == 'SAT':
+        return SAT(kb, query, budget)
+    elif name == 'SATPRE':
+        return SAT(kb, query, budget, preprocess=True)
+    else:
+        return FC(kb, query, budget=budget)
+
+def portfolio_worker(name, kb, query, time_limit, max_memory, cancel_event, results):
+    worker_signals()
+    budget = Budget(time_limit=time_limit, max_memory=max_memory, cancel_event=cancel_event)
+    try:
+        result = portfolio_engine(name, kb, query, budget)
+    except Exception as error:
+        result = f"UNKNOWN: {type(error).__name__}: {error}"
+    results.put((name, result, budget.elapsed()))
+
+# A KB of distinct facts and distinct rules p1 & ... & pn => q over plain symbols, with a plain symbol as the query.
+# On these FC decides entailment exactly like TT and SAT (FC's counters are only off when facts or rules repeat)
+def definite_horn(kb, query):
+    def plain(atom):
+        return re.fullmatch(r'[^\s~&|()<=>]+', atom) is not None
+    keys = set()
+    for clause in kb:
+        if '=>' in clause:
+            if clause.count('=>') != 1 or '<=>' in clause:
+                return False
+            antecedent, consequent = clause.split('=>')
+            premises = [premise.strip() for premise in antecedent.split('&')]
+            key = (frozenset(premises), consequent.strip())
+            if len(set(premises)) != len(premises) or not all(map(plain, premises + [consequent.strip()])):
+                return False
+        else:
+            key = clause.strip()
+            if not plain(key):
+                return False
+        if key in keys:
+            return False
+        keys.add(key)
+    return plain(query.strip())
+
+# The answer in the requested method's format, or None if this engine's answer cannot be given in it: NO reads the
+# same everywhere, and a TT count drops to SAT's bare YES
+def portfolio_answer(result, family, answer_format):
+    if result == "NO" or family == answer_format:
+        return result
+    if result.startswith("YES") and family == 'TT' and answer_format == 'SAT':
+        return "YES"
+    return None
+
+# Portfolio Method: race several complete engines on the KB in separate processes and answer with the first
+# definitive result, cancelling the others. Engines start in order of how often they won on this KB before (then
+# overall), and at most workers of them run at once. Engines decide the same question as answer_format only if
+# their semantics match it: TT and SAT decide entailment, FC forward closure, and on definite Horn KBs they agree
+def PORTFOLIO(kb, query, answer_format='TT', engines=None, workers=None, stats_file=PORTFOLIO_STATS, budget=None):
+    horn = definite_horn(kb, query)
+    engines = [name for name in engines or PORTFOLIO_ENGINES
+               if horn or (PORTFOLIO_ENGINES[name] == 'FC') == (answer_format == 'FC')]
+    stats = {}
+    if stats_file is not None and os.path.exists(stats_file):
+        try:
+            with open(stats_file) as file:
+                stats = json.load(file)
+        except (OSError, ValueError):
+            stats = {}
+    key = MappedFactStore.kb_hash(kb)
+    wins = Counter(stats.get(key, {}))
+    overall = Counter()
+    for counts in stats.values():
+        overall.update(counts)
+    pending = sorted(engines, key=lambda name: (-wins[name], -overall[name], engines.index(name)))
+    workers = max(1, min(workers or len(pending), len(pending)))
+
+    cancel_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    time_limit = budget.deadline - time.monotonic() if budget is not None and budget.deadline is not None else None
+    running = {}
+    answer = winner = None
+    unknown = []
+    try:
+        while answer is None and (pending or running):
+            while pending and len(running) < workers:
+                name = pending.pop(0)
+                running[name] = multiprocessing.Process(target=portfolio_worker, args=(
+                    name, kb, query, time_limit, budget.max_memory if budget is not None else None, cancel_event, results))
+                running[name].start()
+            try:
+                name, result, elapsed = results.get(timeout=0.05)
+            except queue.Empty:
+                if budget is not None:
+                    budget.check()
+                # A worker that died (killed for memory, crashed) never answers. What a worker put before exiting is
+                # already readable, so the dead are only reaped once the queue is still empty after they were seen dead
+                dead = [name for name, process in running.items() if not process.is_alive()]
+                if dead and results.empty():
+                    for name in dead:
+                        unknown.append(f"{name}: UNKNOWN: worker died (exit code {running.pop(name).exitcode})")
+                continue
+            running.pop(name).join()
+            #print(f"Portfolio: {name} answered {result} in {elapsed:.3f}s") # Debug uncomment to follow the race
+            answer = portfolio_answer(result, PORTFOLIO_ENGINES[name], answer_format) if not result.startswith("UNKNOWN") else None
+            if answer is None:
+                unknown.append(f"{name}: {result}")
+            winner = name
+    except BudgetExceeded as error:
+        return error.result(engines=len(engines))
+    finally:
+        cancel_event.set()
+        # The losers get a moment to notice the cancel event, then are killed: an engine in a step that does not
+        # look at its budget must not hold up the answer
+        for process in running.values():
+            process.join(0.1)
+            if process.is_alive():
+                process.kill()
+                process.join(1)
+
+    if answer is None:
+        return f"UNKNOWN: no engine answered ({'; '.join(unknown)})"
+    # The win counts only order later races, so a file that cannot be written is reported and skipped
+    if stats_file is not None:
+        stats.setdefault(key, {})
+        stats[key][winner] = stats[key].get(winner, 0) + 1
+        try:
+            with open(stats_file + '.tmp', 'w') as file:
+                json.dump(stats, file)
+            os.replace(stats_file + '.tmp', stats_file)
+        except OSError as error:
+            print(f"Warning: could not save the portfolio statistics to {stats_file}: {error.strerror}", file=sys.stderr)
+    return answer
+
+# Cubes to aim for per worker, and how long a cube runs before an idle worker may steal half of it (seconds)
+CUBES_PER_WORKER = 16
+CUBE_STEAL_AFTER = 0.2
+
+# Lookahead: the open symbol whose two values decide the most clauses (and the query), or None if nothing is left to
+# split on. A value that falsifies a KB clause kills its branch, which counts as deciding everything
+def cube_split(trees, query_tree, symbols, cube):
+    assignment = dict.fromkeys(symbols, None)
+    assignment.update(cube)
+    open_trees = [tree for tree in trees if evaluate_partial(tree, assignment) is None]
+    if evaluate_partial(query_tree, assignment) is None:
+        open_trees.append(query_tree)
+    candidates = sorted({symbol for tree in open_trees for symbol in expression_symbols(tree) if assignment.get(symbol, False) is None})
+    best, best_score = None, -1
+    for symbol in candidates:
+        score = 1
+        for value in (False, True):
+            assignment[symbol] = value
+            values = [evaluate_partial(tree, assignment) for tree in open_trees]
+            dead = any(value is False for tree, value in zip(open_trees, values) if tree is not query_tree)
+            score *= len(open_trees) + 1 if dead else sum(value is not None for value in values) + 1
+        assignment[symbol] = None
+        if score > best_score:
+            best, best_score = symbol, score
+    return best
+
+# Split the whole search space into about target cubes, breadth first. Cubes where a KB clause is already false have
+# no models and are dropped; a cube with nothing left to split on is kept as it is
+def lookahead_cubes(kb, query, symbols, target):
+    trees = [parse_expression(clause) for clause in kb]
+    query_tree = parse_expression(query)
+    frontier, cubes = [{}], []
+    while frontier and len(frontier) + len(cubes) < target:
+        cube = frontier.pop(0)
+        symbol = cube_split(trees, query_tree, symbols, cube)
+        if symbol is None:
+            cubes.append(cube)
+            continue
+        for value in (False, True):
+            child = {**cube, symbol: value}
+            assignment = dict.fromkeys(symbols, None)
+            assignment.update(child)
+            if not any(evaluate_partial(tree, assignment) is False for tree in trees):
+                frontier.append(child)
+    return cubes + frontier
+
+# The cancel event a cube worker's budget watches: set when the coordinator asks to steal the running cube or stops
+class StealSignal:
+    def __init__(self, conn):
+        self.conn = conn
+        self.flag = False
+        self.stopped = False
+
+    def is_set(self):
+        while not self.flag and self.conn.poll():
+            message = self.conn.recv()
+            self.flag = True
+            self.stopped = message[0] == 'stop'
+        return self.flag
+
+# Worker loop, over a pipe from a local process or a socket from a remote one: count the models of each cube it is
+# sent, or split the cube in two and hand both halves back when the coordinator steals it
+def cube_worker(conn):
+    kb = query = symbols = trees = query_tree = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == 'stop':
+            return
+        elif message[0] == 'kb':
+            kb, query, symbols = message[1:]
+            trees, query_tree = [parse_expression(clause) for clause in kb], parse_expression(query)
+        elif message[0] == 'cube':
+            cube = dict(message[1])
+            signal = StealSignal(conn)
+            try:
+                counts = count_models_pruned(kb, symbols, query, Budget(cancel_event=signal), cube)
+            except BudgetExceeded:
+                if signal.stopped:
+                    return
+                symbol = cube_split(trees, query_tree, symbols, cube)
+                if symbol is not None:
+                    conn.send(('split', message[1], [tuple({**cube, symbol: value}.items()) for value in (False, True)]))
+                    continue
+                counts = count_models_pruned(kb, symbols, query, cube=cube)
+            conn.send(('count', message[1]) + counts)
+
+# A cube worker started by CUBE itself (a remote one keeps its own signal handling)
+def local_cube_worker(conn):
+    worker_signals()
+    cube_worker(conn)
+
+# A worker on another machine (or terminal) joins a CUBE run that is listening on address
+def cube_client(address, authkey):
+    try:
+        conn = multiprocessing.connection.Client(address, authkey=authkey)
+    except (OSError, multiprocessing.AuthenticationError) as error:
+        print(f"Error: could not join the CUBE run at {address[0]}:{address[1]}: {error}")
         sys.exit(1)
+    cube_worker(conn)
 
-    filename, search_method = sys.argv[1], sys.argv[2]
-    # print(f"Running with filename: {filename} and method: {search_method}") # Debug uncomment to see the filename and search method
-    clauses, query = parse_input(filename)
+# Cube-and-conquer Method: split KB & ~query with lookahead into independent cubes, count each cube's models on a
+# pool of workers (local processes, plus any that connect to listen) and add the counts up centrally. A cube with a
+# model of the KB that falsifies the query is a counterexample and ends the run with NO. Workers pull cubes as
+# they finish, and once the queue is empty an idle worker steals half of the longest-running cube.
+# Messages on the listener are unpickled, so it only admits workers holding authkey; without one a random key is
+# made and printed (to stderr, away from the answer) for the remote workers to join with
+def CUBE(kb, query, workers=None, listen=None, authkey=None, cubes=None, budget=None):
+    symbols = sorted(extract_symbols(kb + [query]))
+    # Without a listener there have to be local workers
+    workers = (os.cpu_count() or 1) if workers is None else workers if listen is not None else max(1, workers)
+    pending = [tuple(cube.items()) for cube in lookahead_cubes(kb, query, symbols, cubes or CUBES_PER_WORKER * max(workers, 1))]
+    #print(f"Cubes: {len(pending)}") # Debug uncomment to see how many cubes the lookahead made
+
+    connections = []
+    processes = []
+    joined = queue.Queue()
+    for _ in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=local_cube_worker, args=(child_conn,), daemon=True)
+        process.start()
+        processes.append(process)
+        joined.put(parent_conn)
+    listener = None
+    if listen is not None:
+        if not authkey:
+            authkey = secrets.token_hex(16).encode()
+            print(f"CUBE: workers join with --cube-worker={listen[0]}:{listen[1]} --authkey={authkey.decode()}", file=sys.stderr, flush=True)
+        listener = multiprocessing.connection.Listener(listen, authkey=authkey)
+
+        def accept():
+            while True:
+                try:
+                    joined.put(listener.accept())
+                except multiprocessing.AuthenticationError:
+                    continue
+                except OSError:
+                    # The listener was closed
+                    return
+
+        threading.Thread(target=accept, daemon=True).start()
+
+    running = {}
+    stealing = set()
+    models_where_kb_true = models_where_kb_and_query_true = 0
+    counterexample = False
+    try:
+        while (pending or running) and not counterexample:
+            while not joined.empty():
+                conn = joined.get()
+                conn.send(('kb', kb, query, symbols))
+                connections.append(conn)
+            for conn in connections:
+                if conn not in running and pending:
+                    running[conn] = (pending.pop(0), time.monotonic())
+                    conn.send(('cube', running[conn][0]))
+            # Nothing left to hand out while some worker waits: take half of the cube that has run longest
+            idle = len(connections) - len(running)
+            if not pending and idle > len(stealing) and running:
+                conn, (cube, started) = min(running.items(), key=lambda item: item[1][1])
+                if conn not in stealing and time.monotonic() - started > CUBE_STEAL_AFTER:
+                    conn.send(('steal',))
+                    stealing.add(conn)
+            if budget is not None:
+                budget.check()
+            for conn in multiprocessing.connection.wait(connections, timeout=0.05):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    # A worker that goes away gives its cube back
+                    connections.remove(conn)
+                    stealing.discard(conn)
+                    if conn in running:
+                        pending.insert(0, running.pop(conn)[0])
+                    continue
+                stealing.discard(conn)
+                if conn not in running or running[conn][0] != message[1]:
+                    continue
+                del running[conn]
+                if message[0] == 'split':
+                    pending[:0] = message[2]
+                else:
+                    models_where_kb_true += message[2]
+                    models_where_kb_and_query_true += message[3]
+                    counterexample = counterexample or message[3] < message[2]
+    except BudgetExceeded as error:
+        return error.result(cubes_left=len(pending) + len(running), models=models_where_kb_true)
+    finally:
+        for conn in connections:
+            try:
+                conn.send(('stop',))
+            except OSError:
+                pass
+        if listener is not None:
+            listener.close()
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+    #print(f"Models where KB is true: {models_where_kb_true}, Models where both KB and Query are true: {models_where_kb_and_query_true}") #Debug to see the final counts
+    if models_where_kb_true > 0 and not counterexample:
+        return f"YES: {models_where_kb_and_query_true}"
+    return "NO"
+
+# Build the proof DAG {rule id: rule ids of its premises} that FC's justifications give for the query
+def proof_dag(justification, query):
+    dag = {}
+
+    def visit(symbol):
+        rule_id, premises = justification[symbol]
+        if rule_id not in dag:
+            dag[rule_id] = None
+            dag[rule_id] = tuple(visit(premise) for premise in premises if premise in justification)
+            # Re-insert so that every rule comes after the rules it depends on
+            dag[rule_id] = dag.pop(rule_id)
+        return rule_id
+
+    visit(query)
+    return dag
+
+proof_cache = {}
+
+# Methods whose YES means the query is in FC's forward closure, so FC's justifications are their proof
+FORWARD_METHODS = ('FC', 'PFC', 'BC', 'BCP')
+
+# Explain a YES answer as a proof DAG over rule ids (positions in kb): the rules fired and facts used for FC and the
+# other FORWARD_METHODS, the unsat core of KB & ~query for the refutation methods. Returns None when there is nothing
+# to explain
+def explain(kb, query, search_method):
+    key = (search_method in FORWARD_METHODS, tuple(kb), query)
+    if key not in proof_cache:
+        if search_method in FORWARD_METHODS:
+            justification = {}
+            FC(kb, query, justification)
+            proof_cache[key] = proof_dag(justification, query) if query in justification else None
+        else:
+            proof_cache[key] = SATSession(kb, selectors=True).explain(query)
+    return proof_cache[key]
 
+def format_proof(kb, proof):
+    if proof is None:
+        return "PROOF: none"
+    lines = ["PROOF:"]
+    for rule_id, premises in proof.items():
+        line = f"  #{rule_id} {kb[rule_id]}"
+        if premises:
+            line += " <- " + ", ".join(f"#{premise}" for premise in premises)
+        lines.append(line)
+    return "\n".join(lines)
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+def make_budget(settings, cancel_event=None):
+    return Budget(time_limit=float(settings['time-limit']) if 'time-limit' in settings else None,
+                  max_steps=int(settings['max-steps']) if 'max-steps' in settings else None,
+                  max_memory=float(settings['max-memory']) if 'max-memory' in settings else None,
+                  cancel_event=cancel_event)
+
+# Answer one query with the named method and the command line settings; None if there is no such method.
+# session is the SATSession (SAT) or BCTable (BC) to reuse across queries
+def solve(search_method, clauses, query, settings, options, budget, session=None, checkpoint=None):
     if search_method == 'TT':
-        result = TT(clauses, query)
-        print(result)
+        return TT(clauses, query, enumeration=settings.get('enumeration', 'dag'), budget=budget, preprocess='--preprocess' in options,
+                  checkpoint=checkpoint)
+    elif search_method == 'TTP':
+        return TT(clauses, query, enumeration='pruned', budget=budget, preprocess='--preprocess' in options)
+    elif search_method == 'SAT' and '--preprocess' in options:
+        return SAT(clauses, query, budget, preprocess=True)
+    elif search_method == 'SAT':
+        return (session or SATSession(clauses)).ask(query, budget)
+    elif search_method == 'FC' and 'store' in settings:
+        try:
+            store = MappedFactStore.load(settings['store'], clauses, budget)
+        except BudgetExceeded as error:
+            return error.result()
+        result = store.ask(query)
+        store.close()
+        return result
     elif search_method == 'FC':
-        result = FC(clauses, query)
-        print(result)
+        return FC(clauses, query, budget=budget)
     elif search_method == 'BC':
-        result = BC(clauses, query)
-        print(result)
-    else:
-        print("Invalid search method")
+        return (session or BCTable(clauses)).ask(query, budget)
+    elif search_method == 'BCP':
+        return (session or GoalPlanner(clauses)).ask(query, budget)
+    elif search_method == 'PFC':
+        return PFC(clauses, query, budget=budget)
+    elif search_method == 'PORTFOLIO':
+        return PORTFOLIO(clauses, query, answer_format=settings.get('format', 'TT'),
+                         engines=settings['engines'].split(',') if 'engines' in settings else None,
+                         workers=int(settings['workers']) if 'workers' in settings else None,
+                         stats_file=settings.get('stats', PORTFOLIO_STATS), budget=budget)
+    elif search_method == 'CUBE':
+        return CUBE(clauses, query, workers=int(settings['workers']) if 'workers' in settings else None,
+                    listen=parse_address(settings['listen']) if 'listen' in settings else None,
+                    authkey=settings['authkey'].encode() if 'authkey' in settings else None,
+                    cubes=int(settings['cubes']) if 'cubes' in settings else None, budget=budget)
+    elif search_method == 'ATT':
+        return ATT(clauses, query, epsilon=float(settings.get('epsilon', 0.8)), delta=float(settings.get('delta', 0.2)),
+                   time_budget=float(settings.get('time-budget', 60.0)), approximation=settings.get('approximation', 'sampling'),
+                   budget=budget)
+    return None
+
+# Solve one KB file with every method for the bulk mode, as JSON lines. Loader errors are printed and exit in the
+# single-file CLI, so here they are captured and reported as the error of each line
+def bulk_task(filename, methods, settings, options):
+    started = time.monotonic()
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            clauses, query = parse_input(filename)
+    except SystemExit:
+        clauses = query = None
+    parse_seconds = time.monotonic() - started
+    lines = []
+    for method in methods:
+        record = {'file': filename, 'method': method, 'query': query}
+        if clauses is None or query is None:
+            record['error'] = output.getvalue().strip() or "no ASK section"
+        else:
+            budget = make_budget(settings)
+            try:
+                result = solve(method, clauses, query, settings, options, budget)
+            except Exception as error:
+                record['error'] = f"{type(error).__name__}: {error}"
+            else:
+                if result is None:
+                    record['error'] = "Invalid search method"
+                else:
+                    record.update(result=result, answer=result.split(':')[0], clauses=len(clauses))
+            record.update(seconds=round(budget.elapsed(), 6), steps=budget.steps)
+        record['parse_seconds'] = round(parse_seconds, 6)
+        lines.append(json.dumps(record))
+    return lines
+
+# Files a bulk run covers: every file in a directory, or the matches of a glob pattern, in sorted order
+def bulk_files(pattern):
+    if os.path.isdir(pattern):
+        return sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                      if not name.startswith('.') and os.path.isfile(os.path.join(pattern, name)))
+    return sorted(glob.glob(pattern))
+
+# Bulk mode: solve many KB files with one or more methods in a pool of jobs processes (started once, so the
+# interpreter and imports are paid once per process), writing one JSON line per (file, method) in file order
+def bulk_run(pattern, methods, settings, options, jobs=None, output=sys.stdout):
+    files = bulk_files(pattern)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) < 2:
+        results = (bulk_task(filename, methods, settings, options) for filename in files)
+        for lines in results:
+            for line in lines:
+                print(line, file=output, flush=True)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for lines in pool.map(bulk_task, files, itertools.repeat(methods), itertools.repeat(settings), itertools.repeat(options)):
+            for line in lines:
+                print(line, file=output, flush=True)
+
+def main():
+    options = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    # Options with a value are written --name=value
+    settings = dict(option[2:].split('=', 1) for option in options if '=' in option)
+    # A remote cube-and-conquer worker only needs the coordinator's address
+    if 'cube-worker' in settings:
+        if not settings.get('authkey'):
+            print("Error: --cube-worker needs the --authkey of the CUBE run it joins.")
+            sys.exit(1)
+        cube_client(parse_address(settings['cube-worker']), settings['authkey'].encode())
+        return
+    if len(args) < 2:
+        print("Usage: python iengine.py <filename> <search_method> [query ...] [--proof] [--preprocess] [--enumeration=dag|compiled|symmetric|gray|table|vector] [--store=DIR] [--stream=derivation|sorted] [--result=closure|count|query] [--bc-stats=FILE] [--save-kb=FILE] [--checkpoint=DIR [--resume] --shards=N --workers=N] [--time-limit=S --max-steps=N --max-memory=MB]"
+              " [--epsilon=E --delta=D --time-budget=S --approximation=sampling|hashing]"
+              " [--format=TT|SAT|FC --engines=TT,SAT,... --workers=N --stats=FILE] [--listen=HOST:PORT --cubes=N --authkey=KEY]\n"
+              "       python iengine.py --cube-worker=HOST:PORT --authkey=KEY\n"
+              "       python iengine.py <directory|glob> BULK <search_method> [search_method ...] [--jobs=N] [--output=FILE]")
+        sys.exit(1)
+
+    filename, search_method = args[0], args[1]
+    if search_method == 'BULK':
+        methods = [method for arg in args[2:] for method in arg.split(',')]
+        if 'output' in settings:
+            with open(settings['output'], 'w') as output:
+                bulk_run(filename, methods, settings, options, int(settings['jobs']) if 'jobs' in settings else None, output)
+        else:
+            bulk_run(filename, methods, settings, options, int(settings['jobs']) if 'jobs' in settings else None)
+        return
+    # print(f"Running with filename: {filename} and method: {search_method}") # Debug uncomment to see the filename and search method
+    clauses, query = parse_input(filename)
+    # Extra queries on the command line are all answered against the same parsed KB
+    queries = args[2:] or [query]
+    if 'save-kb' in settings:
+        save_kb(clauses, settings['save-kb'])
+    if query is None and not args[2:]:
+        print("Error: a binary KB has no ASK section, give the query on the command line.")
+        sys.exit(1)
+    session = SATSession(clauses) if search_method == 'SAT' else BCTable(clauses) if search_method == 'BC' else None
+    # The planner's statistics live next to the KB file unless --bc-stats says otherwise
+    if search_method == 'BCP':
+        session = GoalPlanner(clauses, settings.get('bc-stats', filename + '.bcstats.json'))
+
+    checkpoint = None
+    if 'checkpoint' in settings:
+        checkpoint = CheckpointedCount(settings['checkpoint'], shards=int(settings.get('shards', 1)),
+                                       workers=int(settings.get('workers', 1)), resume='--resume' in options)
+
+    # Ctrl-C (or a SIGTERM from a scheduler pre-empting the job) cancels the running engine cooperatively, so it still
+    # reports what it got done and checkpoints are written
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: cancel_event.set())
+
+    for query in queries:
+        budget = make_budget(settings, cancel_event)
+        # --stream and --result make FC write its closure (or just its size or answer) as it goes
+        if search_method == 'FC' and ('stream' in settings or 'result' in settings) and 'store' not in settings:
+            result = stream_fc(clauses, query, sys.stdout, order=settings.get('stream', 'sorted'),
+                               result=settings.get('result', 'closure'), budget=budget)
+        else:
+            result = solve(search_method, clauses, query, settings, options, budget, session, checkpoint)
+            if result is None:
+                print("Invalid search method")
+                continue
+            # --result=query prints only the answer of the other methods (UNKNOWN keeps its reason)
+            if settings.get('result') == 'query' and not result.startswith('UNKNOWN'):
+                print(result.split(':')[0])
+            else:
+                print(result)
+
+        if '--proof' in options and result.startswith('YES') and search_method not in ('ATT', 'PORTFOLIO', 'CUBE'):
+            print(format_proof(clauses, session.explain(query) if search_method == 'SAT' else explain(clauses, query, search_method)))
+
+    if search_method == 'BCP':
+        session.save()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,537 @@
+import io
+import json
+import os
+import random
+import signal
+import tempfile
+import unittest
+
+import iengine
+
+# Differential tests: every optimised engine against the plain one it replaces, on seeded random KBs.
+# Run with python -m unittest test_iengine (or pytest)
+
+def random_literal(rng, symbols):
+    return ('~' if rng.random() < 0.3 else '') + rng.choice(symbols)
+
+def random_clause(rng, symbols):
+    join = lambda op: op.join(random_literal(rng, symbols) for _ in range(rng.randint(1, 3)))
+    kind = rng.random()
+    if kind < 0.3:
+        return random_literal(rng, symbols)
+    if kind < 0.6:
+        return join('&') + '=>' + random_literal(rng, symbols)
+    if kind < 0.75:
+        return join('||')
+    if kind < 0.85:
+        return random_literal(rng, symbols) + '<=>' + join(rng.choice(['&', '||']))
+    if kind < 0.95:
+        return join('&')
+    return join('&') + ' || ' + join('&')
+
+# A KB of general clauses (no parentheses, which evaluate_expression does not read) and a query
+def random_kb(rng, size=None, clauses=None):
+    symbols = [f"s{i}" for i in range(size or rng.randint(1, 8))]
+    kb = [random_clause(rng, symbols) for _ in range(clauses or rng.randint(1, 8))]
+    return kb, rng.choice([random_literal(rng, symbols), random_clause(rng, symbols)])
+
+# A Horn KB; with repeats=True facts and rules may be told more than once, which FC counts
+def random_horn(rng, size=10, rules=12, facts=3, repeats=True):
+    symbols = [f"p{i}" for i in range(size)]
+    kb = ['&'.join(rng.sample(symbols, rng.randint(1, 3))) + '=>' + rng.choice(symbols) for _ in range(rules)]
+    kb += rng.sample(symbols, facts)
+    if repeats:
+        kb += rng.sample(kb, 2)
+    else:
+        kb = list(dict.fromkeys(kb))
+    rng.shuffle(kb)
+    return kb, rng.choice(symbols)
+
+# The original truth table: one enumeration over every symbol, no components, no preprocessing
+def reference_tt(kb, query):
+    symbols = sorted(iengine.extract_symbols(kb + [query]))
+    models_where_kb_true, models_where_kb_and_query_true = iengine.count_models(kb, symbols, query)
+    if models_where_kb_true > 0 and models_where_kb_and_query_true == models_where_kb_true:
+        return f"YES: {models_where_kb_and_query_true}"
+    return "NO"
+
+# Check a model counter against count_models on random KBs
+def check_counter(test, count, seed, trials=300):
+    rng = random.Random(seed)
+    for _ in range(trials):
+        kb, query = random_kb(rng)
+        symbols = sorted(iengine.extract_symbols(kb + [query]))
+        test.assertEqual(count(kb, symbols, query), iengine.count_models(kb, symbols, query), (kb, query))
+
+class TestComponents(unittest.TestCase):
+    def test_tt_matches_the_single_enumeration(self):
+        rng = random.Random(26)
+        for _ in range(400):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.TT(kb, query, enumeration='table'), reference_tt(kb, query), (kb, query))
+
+    def test_independent_facts(self):
+        kb = [f"f{i}" for i in range(2000)]
+        self.assertEqual(iengine.TT(kb, 'f7'), "YES: 1")
+
+class TestGrayCode(unittest.TestCase):
+    def test_gray_matches_count_models(self):
+        check_counter(self, iengine.count_models_gray, 27)
+
+class TestPrunedSearch(unittest.TestCase):
+    def test_pruned_matches_count_models(self):
+        check_counter(self, iengine.count_models_pruned, 28)
+
+    def test_ttp_matches_tt(self):
+        rng = random.Random(280)
+        for _ in range(300):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.TT(kb, query, enumeration='pruned'), reference_tt(kb, query), (kb, query))
+
+class TestSAT(unittest.TestCase):
+    def test_sat_agrees_with_tt(self):
+        rng = random.Random(29)
+        for _ in range(400):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.SAT(kb, query), reference_tt(kb, query).split(':')[0], (kb, query))
+
+    def test_session_reused_across_queries(self):
+        rng = random.Random(290)
+        for _ in range(50):
+            kb, _ = random_kb(rng)
+            session = iengine.SATSession(kb)
+            for _ in range(5):
+                _, query = random_kb(rng)
+                self.assertEqual(session.ask(query), reference_tt(kb, query).split(':')[0], (kb, query))
+
+class TestProofs(unittest.TestCase):
+    def test_forward_proof_is_enough_for_fc(self):
+        rng = random.Random(30)
+        for _ in range(200):
+            kb, query = random_horn(rng, repeats=False)
+            if not iengine.FC(kb, query).startswith("YES"):
+                continue
+            proof = iengine.explain(kb, query, 'FC')
+            for rule_id, premises in proof.items():
+                self.assertTrue(all(premise in proof for premise in premises), (kb, proof))
+            self.assertTrue(iengine.FC([kb[rule_id] for rule_id in proof], query).startswith("YES"), (kb, proof))
+            self.assertEqual(iengine.explain(kb, query, 'PFC'), proof)
+
+    def test_unsat_core_entails_the_query(self):
+        rng = random.Random(300)
+        for _ in range(200):
+            kb, query = random_kb(rng)
+            if iengine.SAT(kb, query) != "YES":
+                continue
+            core = iengine.explain(kb, query, 'SAT')
+            self.assertTrue(reference_tt([kb[rule_id] for rule_id in core], query).startswith("YES"), (kb, query, core))
+
+class TestForwardTMS(unittest.TestCase):
+    def test_retract_matches_recomputation(self):
+        rng = random.Random(9)
+        for _ in range(200):
+            kb, query = random_horn(rng, repeats=False)
+            tms = iengine.ForwardTMS(kb)
+            self.assertEqual(tms.ask(query), iengine.FC(kb, query), kb)
+            remaining = list(kb)
+            for clause in rng.sample(kb, 3):
+                tms.retract(clause)
+                remaining.remove(clause)
+                self.assertEqual(tms.ask(query), iengine.ForwardTMS(remaining).ask(query), (kb, clause))
+                self.assertEqual(tms.ask(query), iengine.FC(remaining, query), (kb, clause))
+
+    def test_tell_after_retract(self):
+        tms = iengine.ForwardTMS(['a', 'a => b'])
+        tms.retract('a')
+        self.assertEqual(tms.ask('b'), "NO")
+        tms.tell('a')
+        self.assertEqual(tms.ask('b'), "YES: a, b")
+
+class TestParallelFC(unittest.TestCase):
+    def test_pfc_matches_fc(self):
+        rng = random.Random(32)
+        for _ in range(300):
+            kb, query = random_horn(rng)
+            self.assertEqual(iengine.PFC(kb, query, workers=1), iengine.FC(kb, query), kb)
+
+    def test_pfc_workers_match_fc(self):
+        rng = random.Random(320)
+        saved, iengine.PFC_MIN_DELTA = iengine.PFC_MIN_DELTA, 1
+        try:
+            for _ in range(5):
+                kb, query = random_horn(rng, size=40, rules=80, facts=5)
+                self.assertEqual(iengine.PFC(kb, query, workers=2), iengine.FC(kb, query), kb)
+        finally:
+            iengine.PFC_MIN_DELTA = saved
+
+class TestBCTable(unittest.TestCase):
+    def test_table_after_retract_matches_bc(self):
+        rng = random.Random(33)
+        goals = [f"p{i}" for i in range(10)]
+        for _ in range(200):
+            kb, _ = random_horn(rng)
+            table = iengine.BCTable(kb)
+            remaining = list(kb)
+            for clause in rng.sample(kb, 3):
+                for query in rng.sample(goals, 3):
+                    self.assertEqual(table.ask(query), iengine.BC(remaining, query), (remaining, query))
+                table.retract(clause)
+                remaining.remove(clause)
+            query = rng.choice(goals)
+            self.assertEqual(table.ask(query), iengine.BC(remaining, query), (remaining, query))
+
+    def test_tell_matches_bc(self):
+        rng = random.Random(330)
+        for _ in range(100):
+            kb, query = random_horn(rng)
+            table = iengine.BCTable(kb[:5])
+            table.ask(query)
+            for clause in kb[5:]:
+                table.tell(clause)
+            self.assertEqual(table.ask(query), iengine.BC(kb, query), kb)
+
+class TestVectorEvaluation(unittest.TestCase):
+    def setUp(self):
+        try:
+            iengine.load_numpy("the vector tests")
+        except ImportError:
+            self.skipTest("numpy is not installed")
+
+    def test_vector_matches_count_models(self):
+        check_counter(self, iengine.count_models_vector, 34)
+
+    def test_evaluate_batch_matches_evaluate_expression(self):
+        rng = random.Random(340)
+        for _ in range(100):
+            kb, query = random_kb(rng)
+            symbols = sorted(iengine.extract_symbols(kb + [query]))
+            rows = [[rng.random() < 0.5 for _ in symbols] for _ in range(8)]
+            kb_values, query_values = iengine.evaluate_batch(kb, query, symbols, rows)
+            for row, kb_value, query_value in zip(rows, kb_values, query_values):
+                assignment = dict(zip(symbols, row))
+                self.assertEqual(bool(kb_value), all(iengine.evaluate_clause(clause, assignment) for clause in kb), kb)
+                self.assertEqual(bool(query_value), iengine.evaluate_clause(query, assignment), query)
+
+class TestApproximateCount(unittest.TestCase):
+    def test_few_models_are_counted_exactly(self):
+        rng = random.Random(35)
+        for _ in range(100):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.ATT(kb, query, time_budget=5, seed=1), reference_tt(kb, query), (kb, query))
+
+    def test_estimate_interval(self):
+        kb = [f"a{i} || b{i}" for i in range(20)]
+        result = iengine.ATT(kb, 'a0 || b0', time_budget=10, seed=1)
+        estimate, interval = result[len("YES: ~"):].split(' [')
+        lower, upper = map(int, interval.split(']')[0].split(', '))
+        self.assertTrue(lower <= int(estimate) <= upper, result)
+        self.assertTrue(lower <= 3 ** 20 <= upper, result)
+
+class TestBudget(unittest.TestCase):
+    def test_step_limit_gives_unknown(self):
+        kb = [f"a{i} || a{i + 1}" for i in range(16)]
+        self.assertTrue(iengine.TT(kb, 'a0', budget=iengine.Budget(max_steps=10)).startswith("UNKNOWN: step limit reached"))
+        rng = random.Random(36)
+        horn, query = random_horn(rng, size=200, rules=400, facts=20)
+        self.assertTrue(iengine.FC(horn, query, budget=iengine.Budget(max_steps=2)).startswith("UNKNOWN"))
+
+    def test_session_usable_after_abort(self):
+        rng = random.Random(360)
+        for _ in range(50):
+            kb, query = random_kb(rng, size=8, clauses=8)
+            session = iengine.SATSession(kb)
+            session.ask(query, iengine.Budget(max_steps=1))
+            self.assertEqual(session.ask(query), reference_tt(kb, query).split(':')[0], (kb, query))
+
+    def test_cancel_event(self):
+        budget = iengine.Budget()
+        budget.cancel()
+        self.assertTrue(iengine.TT([f"a{i} || a{i + 1}" for i in range(16)], 'a0', budget=budget).startswith("UNKNOWN: cancelled"))
+
+    def test_memory_cap_counts_only_the_run(self):
+        self.assertEqual(iengine.TT(['P => Q', 'P'], 'Q', budget=iengine.Budget(max_memory=1)), "YES: 1")
+
+class TestMappedFactStore(unittest.TestCase):
+    def test_store_matches_fc(self):
+        rng = random.Random(37)
+        with tempfile.TemporaryDirectory() as directory:
+            for trial in range(30):
+                kb, query = random_horn(rng)
+                store = iengine.MappedFactStore.load(directory, kb)
+                self.assertEqual(store.ask(query), iengine.FC(kb, query), kb)
+                store.close()
+                # Reattaching reads the saved closure
+                store = iengine.MappedFactStore.load(directory, kb)
+                self.assertEqual(store.ask(query), iengine.FC(kb, query), kb)
+                store.close()
+
+    def test_interrupted_build_is_not_reused(self):
+        kb = ['a0'] + [f"a{i} => a{i + 1}" for i in range(50)]
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(iengine.BudgetExceeded):
+                iengine.MappedFactStore.load(directory, kb, iengine.Budget(max_steps=3))
+            store = iengine.MappedFactStore.load(directory, kb)
+            self.assertEqual(store.ask('a50'), iengine.FC(kb, 'a50'))
+            store.close()
+
+    def test_attached_reader_survives_a_rebuild(self):
+        with tempfile.TemporaryDirectory() as directory:
+            old = iengine.MappedFactStore.load(directory, ['a', 'a => b'])
+            new = iengine.MappedFactStore.load(directory, ['x', 'x => y'])
+            self.assertEqual(old.ask('b'), "YES: a, b")
+            self.assertEqual(new.ask('y'), "YES: x, y")
+            old.close()
+            new.close()
+
+class TestLoading(unittest.TestCase):
+    def parse(self, text, name='kb.txt', files=None):
+        with tempfile.TemporaryDirectory() as directory:
+            for other, content in (files or {}).items():
+                with open(os.path.join(directory, other), 'w') as file:
+                    file.write(content)
+            with open(os.path.join(directory, name), 'w') as file:
+                file.write(text)
+            return iengine.parse_input(os.path.join(directory, name))
+
+    def test_keywords_anywhere_on_a_line(self):
+        self.assertEqual(self.parse("TELL P=>Q; P; ASK Q"), (['P=>Q', 'P'], 'Q'))
+        self.assertEqual(self.parse("TELL\tP=>Q; P;\nASK\nQ\n"), (['P=>Q', 'P'], 'Q'))
+
+    def test_text_before_the_first_tell_is_ignored(self):
+        self.assertEqual(self.parse("# shared rules\nTELL\nP=>Q; P;\nASK\nQ\n"), (['P=>Q', 'P'], 'Q'))
+
+    def test_several_tell_blocks_and_includes(self):
+        clauses, query = self.parse("INCLUDE lib.txt\nTELL\nb => c;\nTELL c => d;\nASK\nd\n", files={'lib.txt': "TELL a; a => b;\n"})
+        self.assertEqual((clauses, query), (['a', 'a => b', 'b => c', 'c => d'], 'd'))
+
+    def test_binary_kb_round_trip(self):
+        rng = random.Random(38)
+        kb, _ = random_kb(rng, clauses=20)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'kb.bin')
+            iengine.save_kb(kb, path)
+            self.assertEqual(list(iengine.parse_input(path)[0]), kb)
+
+class TestFormulaDAG(unittest.TestCase):
+    def test_dag_matches_count_models(self):
+        check_counter(self, iengine.count_models_dag, 39)
+
+class TestPreprocessing(unittest.TestCase):
+    def test_preprocessing_keeps_the_answer_and_count(self):
+        rng = random.Random(40)
+        for _ in range(400):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.TT(kb, query, preprocess=True), reference_tt(kb, query), (kb, query))
+            self.assertEqual(iengine.SAT(kb, query, preprocess=True), reference_tt(kb, query).split(':')[0], (kb, query))
+
+    def test_simplifier_models_extend_to_the_original(self):
+        rng = random.Random(400)
+        for _ in range(300):
+            kb, _ = random_kb(rng)
+            symbols = sorted(iengine.extract_symbols(kb))
+            symbol_ids = {symbol: i + 1 for i, symbol in enumerate(symbols)}
+            clauses = [cnf for clause in kb for cnf in iengine.expression_cnf(iengine.parse_expression(clause), symbol_ids)]
+            simplifier = iengine.Simplifier(clauses, exact=False).run()
+            solver = iengine.SATSolver()
+            variables = {}
+            satisfiable = simplifier.ok
+            for clause in simplifier.clauses if satisfiable else ():
+                for lit in clause:
+                    if abs(lit) not in variables:
+                        variables[abs(lit)] = solver.new_var()
+                satisfiable = solver.add_clause([variables[lit] if lit > 0 else -variables[-lit] for lit in clause]) and satisfiable
+            satisfiable = satisfiable and solver.solve()
+            self.assertEqual(satisfiable, iengine.count_models(kb, symbols)[0] > 0, kb)
+            if satisfiable:
+                model = simplifier.reconstruct({v: solver.model[var] for v, var in variables.items()})
+                for clause in clauses:
+                    self.assertTrue(any(model.get(abs(lit), False) == (lit > 0) for lit in clause), (kb, clause))
+
+    def test_many_facts_within_budget(self):
+        kb = [f"f{i}" for i in range(5000)]
+        self.assertEqual(iengine.TT(kb, 'f7', preprocess=True), "YES: 1")
+        self.assertTrue(iengine.TT(kb, 'f7', preprocess=True, budget=iengine.Budget(max_steps=100)).startswith("UNKNOWN"))
+
+class TestCompiledKB(unittest.TestCase):
+    def test_compiled_matches_count_models(self):
+        check_counter(self, iengine.count_models_compiled, 41)
+
+class TestPortfolio(unittest.TestCase):
+    def test_portfolio_matches_tt(self):
+        rng = random.Random(42)
+        for _ in range(5):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.PORTFOLIO(kb, query, stats_file=None), reference_tt(kb, query), (kb, query))
+            self.assertEqual(iengine.PORTFOLIO(kb, query, answer_format='SAT', stats_file=None),
+                             reference_tt(kb, query).split(':')[0], (kb, query))
+
+    def test_portfolio_fc_format(self):
+        rng = random.Random(420)
+        for _ in range(5):
+            kb, query = random_horn(rng)
+            self.assertEqual(iengine.PORTFOLIO(kb, query, answer_format='FC', stats_file=None), iengine.FC(kb, query), kb)
+
+    def test_dead_worker_is_unknown(self):
+        engine = iengine.portfolio_engine
+
+        def crash(name, kb, query, budget):
+            if name == 'TT':
+                os.kill(os.getpid(), signal.SIGKILL)
+            return engine(name, kb, query, budget)
+
+        iengine.portfolio_engine = crash
+        try:
+            self.assertEqual(iengine.PORTFOLIO(['a', 'a => b'], 'b', engines=['TT', 'TTP'], stats_file=None), "YES: 1")
+            result = iengine.PORTFOLIO(['a', 'a => b'], 'b', engines=['TT'], stats_file=None)
+            self.assertEqual(result, "UNKNOWN: no engine answered (TT: UNKNOWN: worker died (exit code -9))")
+        finally:
+            iengine.portfolio_engine = engine
+
+    def test_unwritable_statistics_are_not_an_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stats = os.path.join(directory, 'missing', 'portfolio.json')
+            self.assertEqual(iengine.PORTFOLIO(['a', 'a => b'], 'b', stats_file=stats), "YES: 1")
+
+class TestCube(unittest.TestCase):
+    def test_cube_matches_tt(self):
+        rng = random.Random(43)
+        for _ in range(5):
+            kb, query = random_kb(rng, size=8, clauses=6)
+            self.assertEqual(iengine.CUBE(kb, query, workers=1, cubes=4), reference_tt(kb, query), (kb, query))
+
+    def test_cube_splits_match_count_models(self):
+        rng = random.Random(431)
+        for _ in range(100):
+            kb, query = random_kb(rng)
+            symbols = sorted(iengine.extract_symbols(kb + [query]))
+            halves = [iengine.count_models_pruned(kb, symbols, query, cube={symbols[0]: value}) for value in (False, True)]
+            self.assertEqual(tuple(map(sum, zip(*halves))), iengine.count_models(kb, symbols, query), (kb, query))
+
+class TestCheckpoint(unittest.TestCase):
+    def test_checkpointed_count_matches(self):
+        rng = random.Random(44)
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(20):
+                kb, query = random_kb(rng)
+                checkpoint = iengine.CheckpointedCount(directory, shards=2)
+                self.assertEqual(iengine.TT(kb, query, checkpoint=checkpoint), reference_tt(kb, query), (kb, query))
+
+    def test_resume_after_interrupt(self):
+        kb = [f"a{i} || ~a{i + 1}" for i in range(19)]
+        saved, iengine.CHECKPOINT_BLOCK_BITS = iengine.CHECKPOINT_BLOCK_BITS, 4
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                interrupted = iengine.TT(kb, 'a0 || a5', checkpoint=iengine.CheckpointedCount(directory, shards=2),
+                                         budget=iengine.Budget(max_steps=5000))
+                self.assertTrue(interrupted.startswith("UNKNOWN"), interrupted)
+                resumed = iengine.TT(kb, 'a0 || a5', checkpoint=iengine.CheckpointedCount(directory, shards=2, resume=True))
+                self.assertEqual(resumed, reference_tt(kb, 'a0 || a5'))
+        finally:
+            iengine.CHECKPOINT_BLOCK_BITS = saved
+
+class TestSymmetry(unittest.TestCase):
+    def test_symmetric_matches_count_models(self):
+        check_counter(self, iengine.count_models_symmetric, 45)
+
+    def test_tt_with_symmetric_enumeration(self):
+        # extract_symbols reads ~~a as the symbol ~a, which no clause uses: a component with neither clauses nor query
+        self.assertEqual(iengine.TT(['~~a', 'a => c', 'a'], 'c', enumeration='symmetric'), "YES: 2")
+        rng = random.Random(450)
+        for _ in range(300):
+            kb, query = random_kb(rng)
+            self.assertEqual(iengine.TT(kb, query, enumeration='symmetric'), reference_tt(kb, query), (kb, query))
+
+class TestBulk(unittest.TestCase):
+    def test_bulk_lines_match_the_engines(self):
+        rng = random.Random(46)
+        with tempfile.TemporaryDirectory() as directory:
+            kbs = {}
+            for i in range(5):
+                kb, query = random_horn(rng)
+                path = os.path.join(directory, f"kb{i}.txt")
+                with open(path, 'w') as file:
+                    file.write("TELL\n" + "; ".join(kb) + ";\nASK\n" + query + "\n")
+                kbs[path] = (kb, query)
+            with open(os.path.join(directory, 'bad.txt'), 'w') as file:
+                file.write("TELL a;\n")
+            output = io.StringIO()
+            iengine.bulk_run(directory, ['TT', 'FC'], {}, [], jobs=1, output=output)
+            records = [json.loads(line) for line in output.getvalue().splitlines()]
+            self.assertEqual(len(records), 12)
+            for record in records:
+                if record['file'].endswith('bad.txt'):
+                    self.assertIn('error', record)
+                    continue
+                kb, query = kbs[record['file']]
+                expected = iengine.TT(kb, query) if record['method'] == 'TT' else iengine.FC(kb, query)
+                self.assertEqual(record['result'], expected, record)
+
+class TestTenantKB(unittest.TestCase):
+    def test_tenant_matches_fc_and_bc(self):
+        rng = random.Random(47)
+        pool = iengine.RulePool()
+        for _ in range(300):
+            kb, query = random_horn(rng)
+            library = iengine.RuleLibrary(pool, kb[:len(kb) // 2])
+            tenant = iengine.TenantKB(library, kb[len(kb) // 2:])
+            self.assertEqual(tenant.forward_chain(query), iengine.FC(kb, query), kb)
+            self.assertEqual(tenant.backward_chain(query), iengine.BC(kb, query), kb)
+
+    def test_tenants_do_not_share_their_clauses(self):
+        library = iengine.RuleLibrary(iengine.RulePool(), ['a => b'])
+        first, second = iengine.TenantKB(library, ['a']), iengine.TenantKB(library)
+        self.assertEqual(first.forward_chain('b'), "YES: a, b")
+        self.assertEqual(second.forward_chain('b'), "NO")
+
+class TestGoalPlanner(unittest.TestCase):
+    def test_planner_decides_like_fc(self):
+        rng = random.Random(48)
+        for _ in range(300):
+            kb, query = random_horn(rng, repeats=False)
+            answer = iengine.GoalPlanner(kb).ask(query, iengine.Budget())
+            self.assertEqual(answer.split(':')[0], iengine.FC(kb, query).split(':')[0], kb)
+
+    def test_statistics_are_saved_and_reused(self):
+        rng = random.Random(480)
+        kb, query = random_horn(rng, repeats=False)
+        with tempfile.TemporaryDirectory() as directory:
+            stats = os.path.join(directory, 'kb.bcstats.json')
+            planner = iengine.GoalPlanner(kb, stats)
+            expected = planner.ask(query, iengine.Budget())
+            planner.save()
+            self.assertEqual(iengine.GoalPlanner(kb, stats).ask(query, iengine.Budget()), expected)
+        # An unwritable statistics file is not an error
+        iengine.GoalPlanner(kb, os.path.join(directory, 'missing', 'kb.bcstats.json')).save()
+
+class TestStreaming(unittest.TestCase):
+    def test_sorted_stream_matches_fc(self):
+        rng = random.Random(49)
+        saved = iengine.STREAM_RUN
+        try:
+            for run in (1, 3, saved):
+                iengine.STREAM_RUN = run
+                for _ in range(100):
+                    kb, query = random_horn(rng)
+                    output = io.StringIO()
+                    iengine.stream_fc(kb, query, output, order='sorted')
+                    self.assertEqual(output.getvalue(), iengine.FC(kb, query) + "\n", kb)
+        finally:
+            iengine.STREAM_RUN = saved
+
+    def test_derivation_order_count_and_query(self):
+        rng = random.Random(490)
+        for _ in range(100):
+            kb, query = random_horn(rng)
+            expected = iengine.FC(kb, query)
+            closure = sorted(iengine.fc_closure(kb))
+            output = io.StringIO()
+            iengine.stream_fc(kb, query, output, order='derivation')
+            lines = output.getvalue().splitlines()
+            self.assertEqual(sorted(lines[:-1]), closure, kb)
+            self.assertEqual(lines[-1], f"{expected.split(':')[0]}: {len(closure)}", kb)
+            output = io.StringIO()
+            iengine.stream_fc(kb, query, output, result='query')
+            self.assertEqual(output.getvalue(), expected.split(':')[0] + "\n", kb)
+
+if __name__ == "__main__":
+    unittest.main()